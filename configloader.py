@@ -0,0 +1,28 @@
+# This module handles loading the boards own section of the configuration
+import machine
+
+# Module written for one board by tools/compile_config.py
+COMPILED_MODULE = "compiled_config"
+
+# Input: Path of the full config file, used when no compiled config for this board is deployed
+# Output: Dictionary of the boards unique_id to its config section
+# A compiled config is imported instead of parsing the config of every board with ujson. Compiled
+# configs were validated when they were built, config.json is validated here and raises ValueError.
+def load_configs(config_file="config.json"):
+    board_id = str(machine.unique_id())
+    try:
+        compiled = __import__(COMPILED_MODULE)
+    except ImportError:
+        compiled = None
+    if compiled is not None and compiled.UNIQUE_ID == board_id:
+        return {board_id: compiled.CONFIG}
+    # Only needed without a compiled config, so they are not imported otherwise
+    import ujson
+    import configschema
+    f = open(config_file)
+    configs = ujson.load(f)
+    f.close()
+    if board_id not in configs:
+        raise ValueError("Invalid config: no section for board " + board_id)
+    configschema.check(configs[board_id])
+    return configs
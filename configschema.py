@@ -0,0 +1,259 @@
+# This module handles the validation of a boards config section
+#
+# The same checks run on the host (tools/validate_config.py, tools/compile_config.py) and once on
+# the board at boot, so a bad config fails before the first cycle instead of as a KeyError inside it.
+
+# Value types of the schema, a tuple in place of a type lists the allowed values
+INT = "int"
+NUMBER = "number"
+# A number above 0, e.g. a period the scheduler divides by
+POSITIVE = "positive"
+FLAG = "flag"
+TEXT = "text"
+DATE = "date"
+PIN = "pin"
+POINTS = "points"
+LIST = "list"
+# Highest GPIO number of the ESP32
+MAX_GPIO = 39
+
+CAPABILITIES = ("solenoids", "data_reader", "data_uploader", "pump", "lights", "ec_reader", "pH_reader",
+    "pressure_reader", "temp_reader", "reservoir_temp_reader", "water_level", "nutrient_controller", "fans")
+
+SOLENOID_PINS = ("solenoid_lower_left", "solenoid_lower_right", "solenoid_upper_left", "solenoid_upper_right")
+LIGHT_PINS = ("light_lower_inner", "light_lower_outer", "light_upper_inner", "light_upper_outer")
+TEMPERATURE_PINS = ("DS18B20_root_upper", "DS18B20_root_lower", "DS18B20_plant_upper", "DS18B20_plant_lower")
+DOSING_PINS = ("p_pump1", "p_pump2", "p_pump3", "p_pump4", "p_pump5", "p_pump6",
+    "stirrer_1", "stirrer_2", "stirrer_3", "stirrer_4", "stirrer_5", "circulation_pump")
+PIN_NAMES = ("main_pump", "pressure_sensor", "fan_lower", "fan_upper", "DS18B20_reservoir",
+    "ultrasonic_trigger", "ultrasonic_echo") + SOLENOID_PINS + LIGHT_PINS + TEMPERATURE_PINS + DOSING_PINS
+
+def _section(names, value_type):
+    section = {}
+    for name in names:
+        section[name] = value_type
+    return section
+
+PHASE = {"length_in_days": INT, "light_hours": INT, "target_ec": NUMBER}
+SOLENOID = {"open_time": NUMBER, "period": POSITIVE, "offset": NUMBER}
+CALIBRATION = {"ml_per_s": NUMBER, "lag": NUMBER, "table": POINTS}
+
+SCHEMA = {
+    "esp_type": _section(CAPABILITIES, FLAG),
+    "pin": _section(PIN_NAMES, PIN),
+    "i2c": {"ph": INT, "ec": INT, "I2C_clock": PIN, "I2C_data": PIN},
+    "date": {"lower_grow_start_date": DATE, "upper_grow_start_date": DATE},
+    "phase": {"germ": PHASE, "veg": PHASE, "bloom": PHASE},
+    "light_trigger_hour": INT,
+    "loop_frequency": POSITIVE,
+    "fan_trigger_temperature": NUMBER,
+    "reservoir_height": NUMBER,
+    "serial": TEXT,
+    "ssid": TEXT,
+    "password": TEXT,
+    "pump": {"low_threshold": NUMBER, "high_threshold": NUMBER, "sample_interval": NUMBER, "max_run_time": NUMBER,
+        "min_off_time": NUMBER, "rise_window": NUMBER, "min_rise": NUMBER, "fault_lockout": NUMBER,
+        "curve_samples": INT},
+    "solenoids": {"open_time": NUMBER, "period": POSITIVE, "stagger": NUMBER, "upper_left": SOLENOID,
+        "upper_right": SOLENOID, "lower_left": SOLENOID, "lower_right": SOLENOID},
+    "dosing": {"stir_time": NUMBER, "mix_time": NUMBER, "max_pumps": INT, "nutrient_ml": NUMBER, "water_ml": NUMBER},
+    "ec": {"ratio": LIST, "tolerance": NUMBER, "ml_per_ec": NUMBER, "min_ml": NUMBER, "max_ml": NUMBER,
+        "max_ml_per_hour": NUMBER, "settle_time": NUMBER},
+    "water_level": {"pings": INT, "ping_interval": INT, "max_deviation": NUMBER, "min_confidence": NUMBER,
+        "max_age": NUMBER, "temperature_compensation": FLAG, "fill_below": NUMBER},
+    "ph": {"low": NUMBER, "high": NUMBER, "target": NUMBER, "ml_per_ph": NUMBER, "min_ml": NUMBER, "max_ml": NUMBER,
+        "max_ml_per_hour": NUMBER, "settle_time": NUMBER},
+    "pump_calibration": _section(("p_pump1", "p_pump2", "p_pump3", "p_pump4", "p_pump5", "p_pump6"), CALIBRATION),
+    "pressure": {"samples": INT, "filter": ("none", "moving_average", "median"), "window": INT},
+    "upload": {"url": TEXT, "batch_url": TEXT, "binary_url": TEXT, "stats_url": TEXT, "format": ("json", "binary"),
+        "batch_size": INT, "flush_interval": NUMBER, "queue_file": TEXT, "max_queued": INT, "evict_count": INT,
+        "drain_size": INT, "retry_interval": NUMBER, "timeout": NUMBER,
+        "connect_timeout": NUMBER, "stats_interval": NUMBER},
+    "log": {"buffer_size": INT, "flush_interval": NUMBER, "min_write_interval": NUMBER, "max_size": INT,
+        "generations": INT},
+    "task_period": _section(CAPABILITIES, POSITIVE)
+}
+
+# Keys every board needs, nested keys are written as "section/key"
+REQUIRED = ("esp_type", "pin", "loop_frequency", "ssid", "password")
+
+# Keys of the EZO circuits, which are set up together when either reader or the nutrient controller is enabled
+I2C_KEYS = ("i2c/ph", "i2c/ec", "i2c/I2C_clock", "i2c/I2C_data")
+# GPIOs of the i2c section, checked against the pin section for double use
+I2C_PINS = ("I2C_clock", "I2C_data")
+
+# Keys a board needs for each capability its esp_type enables
+CAPABILITY_REQUIRES = {
+    "pump": ("pin/main_pump", "pin/pressure_sensor"),
+    "pressure_reader": ("pin/pressure_sensor",),
+    "solenoids": tuple("pin/" + name for name in SOLENOID_PINS),
+    "temp_reader": tuple("pin/" + name for name in TEMPERATURE_PINS),
+    "lights": tuple("pin/" + name for name in LIGHT_PINS) + ("date/lower_grow_start_date",
+        "date/upper_grow_start_date", "phase/germ", "phase/veg", "phase/bloom", "light_trigger_hour"),
+    "fans": ("pin/fan_lower", "pin/fan_upper", "pin/DS18B20_plant_lower", "pin/DS18B20_plant_upper",
+        "fan_trigger_temperature"),
+    "water_level": ("pin/ultrasonic_trigger", "pin/ultrasonic_echo", "reservoir_height"),
+    "pH_reader": I2C_KEYS,
+    "ec_reader": I2C_KEYS,
+    "nutrient_controller": tuple("pin/" + name for name in DOSING_PINS) + I2C_KEYS
+}
+
+# Input: Date as a string or list of integers, either a mktime tuple (year, month, mday, hour, minute,
+#        second, weekday, yearday[, isdst]) or an RTC datetime tuple (year, month, day, weekday, hours,
+#        minutes, seconds, subseconds)
+# Output: The date as a mktime tuple
+def parse_date(value):
+    if isinstance(value, str):
+        value = value.strip().strip("()").split(",")
+    fields = [int(field) for field in value]
+    if len(fields) < 3:
+        raise ValueError("expected at least year, month and day")
+    if len(fields) == 8:
+        # RTC().datetime() order, the weekday comes before the time
+        clock = fields[4:7]
+    else:
+        clock = (fields[3:6] + [0, 0, 0])[:3]
+    date = (fields[0], fields[1], fields[2], clock[0], clock[1], clock[2], 0, 0)
+    if not 1 <= date[1] <= 12 or not 1 <= date[2] <= 31 or not 0 <= date[3] <= 23:
+        raise ValueError("date out of range")
+    return date
+
+def _check_value(path, spec, value, errors):
+    if isinstance(spec, dict):
+        if not isinstance(value, dict):
+            errors.append(path + ": expected a section")
+            return
+        for key in value:
+            if key not in spec:
+                errors.append(path + "/" + key + ": unknown key")
+            else:
+                _check_value(path + "/" + key, spec[key], value[key], errors)
+    elif isinstance(spec, tuple):
+        if value not in spec:
+            errors.append(path + ": expected one of " + ", ".join(spec))
+    elif spec == FLAG:
+        if value not in (0, 1):
+            errors.append(path + ": expected 0 or 1")
+    elif spec == INT or spec == PIN:
+        if not isinstance(value, int) or isinstance(value, bool):
+            errors.append(path + ": expected an integer")
+        elif spec == PIN and not 0 <= value <= MAX_GPIO:
+            errors.append(path + ": GPIO " + str(value) + " does not exist")
+    elif spec == NUMBER or spec == POSITIVE:
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            errors.append(path + ": expected a number")
+        elif spec == POSITIVE and value <= 0:
+            errors.append(path + ": expected a number above 0")
+    elif spec == TEXT:
+        if not isinstance(value, str):
+            errors.append(path + ": expected a string")
+    elif spec == POINTS:
+        if not isinstance(value, list) or not value:
+            errors.append(path + ": expected a list of [x, y] points")
+            return
+        last = None
+        for point in value:
+            if not isinstance(point, list) or len(point) != 2 or not all(
+                    isinstance(v, (int, float)) and not isinstance(v, bool) for v in point):
+                errors.append(path + ": expected a list of [x, y] points")
+                return
+            if last is not None and (point[0] <= last[0] or point[1] < last[1]):
+                errors.append(path + ": points have to increase")
+                return
+            last = point
+    elif spec == LIST:
+        if not isinstance(value, list) or not all(
+                isinstance(v, (int, float)) and not isinstance(v, bool) and v >= 0 for v in value):
+            errors.append(path + ": expected a list of numbers")
+    elif spec == DATE:
+        try:
+            parse_date(value)
+        except (ValueError, TypeError) as e:
+            errors.append(path + ": invalid date " + repr(value) + ", " + str(e))
+
+def _has(configs, path):
+    for key in path.split("/"):
+        if not isinstance(configs, dict) or key not in configs:
+            return False
+        configs = configs[key]
+    return True
+
+# Input: Board section of the config
+# Output: List of error messages, empty when the section is valid
+def validate(configs):
+    errors = []
+    if not isinstance(configs, dict):
+        return ["expected a board section"]
+    for key in configs:
+        if key not in SCHEMA:
+            errors.append(key + ": unknown key")
+        else:
+            _check_value(key, SCHEMA[key], configs[key], errors)
+    for path in REQUIRED:
+        if not _has(configs, path):
+            errors.append(path + ": missing")
+    esp_type = configs.get("esp_type")
+    if isinstance(esp_type, dict):
+        for capability in CAPABILITIES:
+            if not _has(esp_type, capability):
+                errors.append("esp_type/" + capability + ": missing")
+            elif esp_type[capability]:
+                for path in CAPABILITY_REQUIRES.get(capability, ()):
+                    if not _has(configs, path):
+                        errors.append(path + ": missing, needed by " + capability)
+    used = {}
+    for section, names in (("pin", None), ("i2c", I2C_PINS)):
+        pins = configs.get(section)
+        if not isinstance(pins, dict):
+            continue
+        for name in pins:
+            if names is not None and name not in names:
+                continue
+            path = section + "/" + name
+            if pins[name] in used:
+                errors.append(path + ": GPIO " + str(pins[name]) + " already used by " + used[pins[name]])
+            used[pins[name]] = path
+    return errors
+
+# Input: Valid board section of the config
+# Output: The same section with the grow start dates converted to mktime tuples
+def prepare(configs):
+    dates = configs.get("date", {})
+    for key in dates:
+        dates[key] = parse_date(dates[key])
+    return configs
+
+# Input: Board section of the config
+# Output: The prepared section
+# Raises ValueError listing every problem when the section is invalid
+def check(configs):
+    errors = validate(configs)
+    if errors:
+        raise ValueError("Invalid config: " + "; ".join(errors))
+    return prepare(configs)
+
+# Input: Parsed config.json
+# Output: Dictionary of unique_id key to board section, without the comment entries
+def board_sections(configs):
+    return {key: value for key, value in configs.items() if not key.startswith("__")}
+
+# Input: Board section of config.json
+# Output: Short profile name of the board
+def profile_name(configs):
+    if configs["esp_type"].get("nutrient_controller"):
+        return "nutrient"
+    return "irrigation"
+
+# Input: Parsed config.json and a unique_id key, profile name or None for the first board
+# Output: Tuple of (unique_id key, board section)
+def find_board(configs, board=None):
+    boards = board_sections(configs)
+    if board is None:
+        key = next(iter(boards))
+        return key, boards[key]
+    if board in boards:
+        return board, boards[board]
+    for key in boards:
+        if profile_name(boards[key]) == board:
+            return key, boards[key]
+    raise KeyError("No board " + repr(board) + " in config, expected a unique_id or one of irrigation, nutrient")
@@ -1,19 +1,173 @@
 # This class handles all the data uploads to the Azure server
 import ujson
-import urequests
+import network
+from time import ticks_ms, ticks_diff
 from logger import Logger
+from uploadqueue import UploadQueue
+from httpsession import HTTPSession
+from telemetry import TelemetryEncoder
+from timing import timed
 
 class DataUploader:
 
     URL = "https://team1-fydp.azurewebsites.net/result"
+    # Accepts a JSON array of readings in a single request
+    BATCH_URL = "https://team1-fydp.azurewebsites.net/result/batch"
+    # Accepts one or more concatenated binary telemetry records
+    BINARY_URL = "https://team1-fydp.azurewebsites.net/result/binary"
+    # Accepts the boards call timing statistics as a JSON object
+    STATS_URL = "https://team1-fydp.azurewebsites.net/result/stats"
     ESP_LOG_FILE = "esp_log.txt"
+    QUEUE_FILE = "upload_queue.txt"
+    # Data reader periods a partial batch waits when flush_interval is not set
+    FLUSH_PERIODS = 3
 
-    def __init__(self):
+    # Input: Optional "upload" section of the board config, the board's telemetry schema and the seconds
+    #        between data_reader runs
+    def __init__(self, configs=None, schema=None, period=60):
+        if configs is None:
+            configs = {}
         self.logger = Logger(self.ESP_LOG_FILE)
+        self.url = configs.get("url", self.URL)
+        self.batch_url = configs.get("batch_url", self.BATCH_URL)
+        self.binary_url = configs.get("binary_url", self.BINARY_URL)
+        self.stats_url = configs.get("stats_url", self.STATS_URL)
+        # "json" (default) or "binary" wire format
+        self.encoder = None
+        if configs.get("format", "json") == "binary":
+            self.encoder = TelemetryEncoder(schema)
+        # Readings sent per request, 1 keeps one PUT per reading on the single reading endpoint
+        self.batch_size = configs.get("batch_size", 1)
+        # Seconds after which a partial batch is sent anyway
+        flush_interval = configs.get("flush_interval", self.FLUSH_PERIODS * period)
+        if flush_interval <= 0 and self.batch_size > 1:
+            raise ValueError("Upload batch_size above 1 needs a flush_interval above 0")
+        self.flush_interval_ms = int(flush_interval * 1000)
+        self.last_send = ticks_ms()
+        self.queue = UploadQueue(configs.get("queue_file", self.QUEUE_FILE),
+            configs.get("max_queued", 200), configs.get("evict_count", 10))
+        # Number of queued readings sent per drain
+        self.drain_size = configs.get("drain_size", 10)
+        # Seconds to wait after a failed upload before the server is tried again
+        self.retry_ms = int(configs.get("retry_interval", 60) * 1000)
+        self.last_failure = None
+        self.station = network.WLAN(network.STA_IF)
+        # One TLS connection is kept open across uploads
+        self.session = HTTPSession(configs.get("timeout", HTTPSession.DEFAULT_TIMEOUT),
+            configs.get("connect_timeout", HTTPSession.CONNECT_TIMEOUT))
 
+    @timed("upload_put")
+    def put(self, url, body, content_type):
+        headers = {"content-type" : content_type}
+        response = self.session.put(url, data = body, headers=headers)
+        if response.status_code < 200 or response.status_code >= 300:
+            raise OSError("Server returned " + str(response.status_code))
+        # The body is only logged, a 2xx with an empty or non-JSON body still means the readings were accepted
+        try:
+            body = response.text
+        except UnicodeError:
+            body = str(response.content)
+        self.logger.log("Server response " + body)
+
+    # Input: List of reading dictionaries
+    # Output: Concatenated binary records of the readings
+    # A reading that cannot be encoded never will be, so it is logged and dropped instead of failing the
+    # upload, which would keep it at the head of the queue
+    def encode(self, batch):
+        records = []
+        for data in batch:
+            try:
+                records.append(self.encoder.encode(data))
+            except Exception as e:
+                self.logger.error("Reading dropped, cannot encode " + str(data) + ": " + str(e))
+        return b"".join(records)
+
+    def send(self, data):
+        if self.encoder is not None:
+            body = self.encode([data])
+            if body:
+                self.put(self.binary_url, body, "application/octet-stream")
+        else:
+            self.put(self.url, ujson.dumps(data), "application/json")
+
+    # Input: List of reading dictionaries
+    # Output: None
+    # Uploads the readings as one JSON array, or concatenated binary records, in a single request
+    def send_batch(self, batch):
+        if self.encoder is not None:
+            body = self.encode(batch)
+            if body:
+                self.put(self.binary_url, body, "application/octet-stream")
+        else:
+            self.put(self.batch_url, ujson.dumps(batch), "application/json")
+
+    # Input: Dictionary of readings
+    # Output: None
+    # Queues the readings on flash and uploads as much of the queue as the link allows
+    @timed("upload_data")
     def upload_data(self, data):
+        self.queue.push(data)
+        self.logger.log("Data queued: " + str(data))
+        self.drain()
+
+    # Input: Dictionary of timing statistics from Timings.report()
+    # Output: True when the statistics were uploaded
+    # Statistics are not queued, a failed upload is dropped and the next report covers the gap
+    def upload_stats(self, stats):
+        if not self.link_up():
+            return False
+        try:
+            self.put(self.stats_url, ujson.dumps(stats), "application/json")
+        except Exception as e:
+            self.last_failure = ticks_ms()
+            self.logger.log("Stats upload failed: " + str(e))
+            return False
+        return True
+
+    def link_up(self):
+        if not self.station.isconnected():
+            self.session.close()
+            return False
+        if self.last_failure is not None and ticks_diff(ticks_ms(), self.last_failure) < self.retry_ms:
+            return False
+        return True
+
+    # A batch is sent once it is full or once flush_interval has passed since the last send
+    def batch_ready(self):
+        if self.batch_size <= 1 or self.queue.count >= self.batch_size:
+            return True
+        return ticks_diff(ticks_ms(), self.last_send) >= self.flush_interval_ms
 
-        headers = {"content-type" : "application/json"}
-        self.logger.log("Data uploaded: " + str(data))
-        response = urequests.put(self.URL, data = ujson.dumps(data), headers=headers)
-        self.logger.log("Server response" + str(response.json()))
+    # Input: None
+    # Output: Number of readings uploaded
+    # Sends up to drain_size of the oldest queued readings, stopping at the first failure
+    def drain(self):
+        if self.queue.count == 0 or not self.link_up() or not self.batch_ready():
+            return 0
+        sent = 0
+        while sent < self.drain_size and self.queue.count:
+            try:
+                batch = self.queue.peek(min(self.batch_size, self.drain_size - sent))
+                if not batch:
+                    break
+                if self.batch_size <= 1:
+                    self.send(batch[0])
+                else:
+                    self.send_batch(batch)
+            except Exception as e:
+                self.last_failure = ticks_ms()
+                self.logger.log("Upload failed: " + str(e))
+                break
+            self.queue.pop(len(batch))
+            sent += len(batch)
+        if sent:
+            self.last_send = ticks_ms()
+            self.last_failure = None
+            self.logger.log("Data uploaded: " + str(sent) + " readings, " + str(self.queue.count) + " queued")
+        if self.queue.evicted:
+            self.logger.log("Upload queue full, " + str(self.queue.evicted) + " readings dropped")
+            self.queue.evicted = 0
+        if self.queue.corrupted:
+            self.logger.error("Upload queue had " + str(self.queue.corrupted) + " unreadable readings, dropped")
+            self.queue.corrupted = 0
+        return sent
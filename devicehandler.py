@@ -1,28 +1,56 @@
 # This class serves as an interface between the ESP and the sensors
 import machine
-from time import sleep, sleep_ms
-from utime import mktime
-import ds18x20
-import onewire
-import dht
+import uasyncio
 from logger import Logger
 from machine import Pin, PWM
-from hcsr04 import HCSR04
+from timing import timed, timed_async
+import drivers
 
 class DeviceHandler:
 
     ESP_LOG_FILE = "esp_log.txt"
+    # Temperatures younger than this are reused instead of starting a new conversion
+    TEMPERATURE_MAX_AGE_MS = 10000
 
     def __init__(self, configs):
         self.logger = Logger(self.ESP_LOG_FILE)
         self.id = str(machine.unique_id())
         self.configs = configs[self.id]
+        # Values read on every cycle are kept as attributes instead of nested dictionary lookups
+        esp_type = self.configs["esp_type"]
+        self.has_pressure = esp_type["pressure_reader"]
+        self.has_ph = esp_type["pH_reader"]
+        self.has_ec = esp_type["ec_reader"]
+        self.has_temp = esp_type["temp_reader"]
+        self.has_reservoir_temp = esp_type["reservoir_temp_reader"]
+        self.has_water_level = esp_type["water_level"]
+        self.reservoir_height = self.configs.get("reservoir_height")
+        self.fan_trigger_temperature = self.configs.get("fan_trigger_temperature")
         # This is a dictionary of all the available pins, allowing pins to be accessed with self.pins["pump"]
         self.pins = self.configure_pins()
+        self.water_level_sensor = self.configure_water_level()
         self.PWM = self.configure_PWM()
-        # Initializes the I2C machine
-        self.i2c = self.configure_i2c()
-
+        self.dosing_engine = self.configure_dosing()
+        self.ph_controller = self.configure_ph_controller()
+        self.ec_controller = self.configure_ec_controller()
+        self.temperature = self.configure_temperature()
+        self.pressure_sensor = self.configure_pressure()
+        self.pump_controller = self.configure_pump()
+        self.solenoid_scheduler = self.configure_solenoids()
+        self.light_scheduler = self.configure_lights()
+        self.i2c = None
+        self.ph_sensor = None
+        self.ec_sensor = None
+        if drivers.needed(self.configs, "ezo"):
+            ezo = drivers.load("ezo")
+            # Initializes the I2C machine
+            self.i2c = self.configure_i2c()
+            self.ph_sensor = ezo.EZOSensor(self.i2c, self.configs["i2c"]["ph"], ezo.EZOSensor.PH_READ_MS)
+            # The EC circuit replies with EC and TDS (ppm)
+            self.ec_sensor = ezo.EZOSensor(self.i2c, self.configs["i2c"]["ec"], ezo.EZOSensor.EC_READ_MS, 2)
+        # Only one set of EZO conversions is in flight at a time
+        self.ezo_lock = uasyncio.Lock()
+        self.logger.log("Drivers loaded: " + str(list(drivers.loaded)))
 
     def configure_i2c(self):
         i2c = machine.I2C(-1, machine.Pin(self.configs["i2c"]["I2C_clock"]), machine.Pin(self.configs["i2c"]["I2C_data"]))
@@ -34,8 +62,8 @@ class DeviceHandler:
         pin_dict = {}
         for pin in self.configs["pin"]:
             if pin == "ultrasonic_echo" or pin == "ultrasonic_trigger":
-                self.water_level_sensor = HCSR04(trigger_pin=self.configs["pin"]["ultrasonic_trigger"], 
-                echo_pin=self.configs["pin"]["ultrasonic_echo"], echo_timeout_us=1000000)
+                # Driven by the HC-SR04 driver in configure_water_level
+                continue
             elif pin != "pressure_sensor" and pin != "DS18B20_reservoir" and pin != "DS18B20_lower":
                 print(pin)
                 pin_dict[pin] = machine.Pin(self.configs["pin"][pin], machine.Pin.OUT)
@@ -43,6 +71,68 @@ class DeviceHandler:
                 pin_dict[pin] = machine.Pin(self.configs["pin"][pin])
         return pin_dict
     
+    def configure_water_level(self):
+        if not drivers.needed(self.configs, "hcsr04"):
+            return None
+        # Time out after an echo from twice the reservoir depth instead of a full second
+        sensor = drivers.load("hcsr04").HCSR04(trigger_pin=self.configs["pin"]["ultrasonic_trigger"],
+            echo_pin=self.configs["pin"]["ultrasonic_echo"], echo_timeout_us=int(self.reservoir_height * 4 * 29.1))
+        from waterlevel import WaterLevel
+        return WaterLevel(sensor, self.reservoir_height, self.configs.get("water_level"), self.reservoir_temperature)
+
+    def configure_temperature(self):
+        if not drivers.needed(self.configs, "ds18b20"):
+            return None
+        bus_pins = {}
+        for pin in self.pins:
+            if "DS18B20" in pin:
+                bus_pins[pin] = self.pins[pin]
+        return drivers.load("ds18b20").TemperatureSensors(bus_pins)
+
+    def configure_pressure(self):
+        if not drivers.needed(self.configs, "pressure"):
+            return None
+        return drivers.load("pressure").PressureSensor(self.pins["pressure_sensor"], self.configs.get("pressure", {}))
+
+    def configure_pump(self):
+        if not self.configs["esp_type"]["pump"] or self.pressure_sensor is None:
+            return None
+        # Imported here so boards without a pump do not load it
+        from pumpcontroller import PumpController
+        return PumpController(self.pressure_sensor, self.turn_on_pump, self.turn_off_pump, self.configs.get("pump"))
+
+    def configure_solenoids(self):
+        if not self.configs["esp_type"]["solenoids"]:
+            return None
+        from solenoidscheduler import SolenoidScheduler
+        period = self.configs.get("task_period", {}).get("solenoids", self.configs["loop_frequency"])
+        return SolenoidScheduler(self.pins, self.configs.get("solenoids"), period)
+
+    def configure_lights(self):
+        if not self.configs["esp_type"]["lights"]:
+            return None
+        from lightscheduler import LightScheduler
+        return LightScheduler(self.configs, self.turn_lights_on, self.turn_lights_off)
+
+    def configure_dosing(self):
+        if not self.configs["esp_type"]["nutrient_controller"]:
+            return None
+        from dosingengine import DosingEngine
+        return DosingEngine(self, self.configs.get("dosing"), self.configs.get("pump_calibration"))
+
+    def configure_ph_controller(self):
+        if self.dosing_engine is None or not self.has_ph:
+            return None
+        from phcontroller import PhController
+        return PhController(self, self.dosing_engine, self.configs.get("ph"))
+
+    # EC control is enabled by the "ec" section, otherwise nutrients are dosed by fill_all_nutrients
+    def configure_ec_controller(self):
+        if self.dosing_engine is None or not self.has_ec or "ec" not in self.configs:
+            return None
+        from eccontroller import ECController
+        return ECController(self, self.dosing_engine, self.configs)
+
     def configure_PWM(self):
         PWM_dict = {}
         for pin in self.pins:
@@ -50,47 +140,66 @@ class DeviceHandler:
                 PWM_dict[pin] = PWM(self.pins[pin])
         return PWM_dict
 
-    def read_ec(self):
-        ec_address = self.configs["i2c"]["ec"]
-        # Request read from EC board
-        self.i2c.writeto(ec_address, 'R')
-        # Wait for 1 second for a response
-        sleep(1)
-        data = self.i2c.readfrom(ec_address, 9).decode("utf-8")
-        ec, ppm = data[1:].split(",")
-        self.logger.log("EC: " + str(ec) + ", PPM: " + str(ppm))
+    @timed_async("read_ec")
+    async def read_ec(self, temperature=None):
+        async with self.ezo_lock:
+            ec = await self.ec_sensor.read(temperature)
+        self.logger.log("EC: " + str(ec) + ", PPM: " + str(self.ec_sensor.values[1]))
         return ec
 
-    def read_ph(self):
-        ph_address = self.configs["i2c"]["ph"]
-        self.i2c.writeto(ph_address, 'R')
-        # Wait for 1 second for a response
-        sleep(1)
-        data = self.i2c.readfrom(ph_address, 6).decode("utf-8")
-
-        ph = data[1:]
+    @timed_async("read_ph")
+    async def read_ph(self, temperature=None):
+        async with self.ezo_lock:
+            ph = await self.ph_sensor.read(temperature)
         self.logger.log("pH: " + str(ph))
-        # outputs pH as a string
         return ph
 
-    def read_water_level(self):
-        water_distance = self.water_level_sensor.distance_cm()
-        return self.configs["reservoir_height"] - water_distance
+    # Input: Optional temperature in C for compensated readings
+    # Output: Dictionary with the pH and EC readings of the enabled circuits
+    # Requests a reading from both circuits together so they share one conversion wait
+    @timed_async("read_ezo")
+    async def read_ezo(self, temperature=None):
+        names = []
+        sensors = []
+        if self.has_ph:
+            names.append("pH")
+            sensors.append(self.ph_sensor)
+        if self.has_ec:
+            names.append("ec")
+            sensors.append(self.ec_sensor)
+        async with self.ezo_lock:
+            values = await drivers.load("ezo").read_all(sensors, temperature)
+        data = {}
+        for i in range(len(names)):
+            if isinstance(values[i], OSError):
+                self.logger.error("Failed to read " + names[i] + ": " + str(values[i]))
+                data[names[i]] = None
+            else:
+                data[names[i]] = values[i]
+        self.logger.log("EZO: " + str(data))
+        return data
+
+    # Input: None
+    # Output: Last reservoir temperature in C, or None when it has not been read
+    def reservoir_temperature(self):
+        if self.temperature is None:
+            return None
+        temps = self.temperature.last_temps.get("DS18B20_reservoir")
+        if not temps:
+            return None
+        return sum(temps) / len(temps)
+
+    @timed_async("read_water_level")
+    async def read_water_level(self, max_age=None):
+        return await self.water_level_sensor.read(max_age)
     
-    def add_water(self):
-        self.pins["p_pump6"].on()
-        sleep(15)
-        self.pins["p_pump6"].off()
+    @timed_async("add_water")
+    async def add_water(self, ml=None):
+        await self.dosing_engine.add_water(ml)
     
-    def add_nutrient(self, num):
-        self.stirrer_on(num)
-        sleep(15)
-        self.stirrer_off(num)
-        str_num = str(num)
-        pump_name = "p_pump" + str_num
-        self.pins[pump_name].on()
-        sleep(5)
-        self.pins[pump_name].off()
+    @timed_async("add_nutrient")
+    async def add_nutrient(self, num, ml=None):
+        await self.dosing_engine.dose_ml([(num,) if ml is None else (num, ml)])
 
     def set_initial_state(self):
         if self.configs["esp_type"]["lights"]:
@@ -112,43 +221,42 @@ class DeviceHandler:
                 self.p_pump_off(pump_num)
             self.circulation_pump_off()
 
+    @timed("read_pressure")
     def read_pressure(self):
-        adc = machine.ADC(self.pins["pressure_sensor"])
-        adc.atten(machine.ADC.ATTN_11DB)
-        adc.width(machine.ADC.WIDTH_12BIT)
-
-        #Caclulate pressure
-        pressure = 0
-        voltagem = 0
-        for i in range(500):
-            adc_value = adc.read()
-            voltage = 3.3 * (adc_value / 4095)
-            voltagem += voltage
-
-        pressure = 49.4*voltagem/i - 10.5
+        pressure = self.pressure_sensor.read()
         self.logger.log("Pressure: " + str(pressure))
         print (str(pressure))
         return pressure
 
-    def read_ds18b20(self, pin):
-        sensor = ds18x20.DS18X20(onewire.OneWire(self.pins[pin]))
-        try:
-            roms = sensor.scan()
-            sensor.convert_temp()
-            sleep_ms(750)
-            temps = []
-            # measure the right then the left sensors
-            for rom in roms:
-                temp = sensor.read_temp(rom)
-                temps.append(temp)
-                
-        except OSError as e:
-            self.logger.log("Failed to read DS18B20 sensor")
-            temp = 0
-        return temps
+    async def read_ds18b20(self, pin):
+        temps = await self.temperature.read([pin])
+        return temps[pin]
+
+    # Input: None
+    # Output: Names of the DS18B20 pins enabled on the board
+    def ds18b20_names(self):
+        names = []
+        if self.has_temp:
+            names += ["DS18B20_root_upper", "DS18B20_root_lower", "DS18B20_plant_upper", "DS18B20_plant_lower"]
+        if self.has_reservoir_temp and "DS18B20_reservoir" in self.pins:
+            names.append("DS18B20_reservoir")
+        return names
+
+    # Input: None
+    # Output: Dictionary of upload field name to list of temperatures
+    # Converts every enabled DS18B20 bus at once so the whole read waits a single conversion time
+    @timed_async("read_all_ds18b20")
+    async def read_all_ds18b20(self):
+        names = self.ds18b20_names()
+        temps = await self.temperature.read(names)
+        data = {}
+        for name in names:
+            data["temperature_" + name[len("DS18B20_"):]] = temps[name]
+        return data
 
+    @timed("read_dht22")
     def read_dht22(self, pin):
-        sensor = dht.DHT22(self.pins[pin])
+        sensor = drivers.load("dht22").DHT22(self.pins[pin])
         try:
             sensor.measure()
             temp = sensor.temperature()
@@ -160,63 +268,48 @@ class DeviceHandler:
 
         return temp, hum
 
-    def open_close_solenoids(self):
+    @timed_async("open_close_solenoids")
+    async def open_close_solenoids(self):
         self.logger.log("Opening solenoids")
 
         self.open_solenoids()
 
-        sleep(10)
+        await uasyncio.sleep(10)
         self.logger.log("Closing solenoids")
 
         self.close_solenoids()
 
-    def read_all_data(self):
+    @timed_async("read_all_data")
+    async def read_all_data(self):
         data = {}
         data["time_sent"] = str(machine.RTC().datetime())
-        if self.configs["esp_type"]["pressure_reader"]:
+        if self.has_pressure:
             data["pressure"] = self.read_pressure()
-        if self.configs["esp_type"]["pH_reader"]:
-            data["pH"] = self.read_ph()
-        if self.configs["esp_type"]["ec_reader"]:
-            data["ec"] = self.read_ec()
-        if self.configs["esp_type"]["temp_reader"]:
-            #data["temperature_reservoir"] = self.read_ds18b20("DS18B20_reservoir")
-            data["temperature_root_upper"] = self.read_ds18b20("DS18B20_root_upper")
-            data["temperature_root_lower"] = self.read_ds18b20("DS18B20_root_lower")
-            data["temperature_plant_upper"] = self.read_ds18b20("DS18B20_plant_upper")
-            data["temperature_plant_lower"] = self.read_ds18b20("DS18B20_plant_lower")
-        if self.configs["esp_type"]["water_level"]:
-            data["water_level"] = self.read_water_level()
+        # Sensors that have to wait on a conversion are read concurrently so their waits overlap
+        reads = []
+        if self.has_ph or self.has_ec:
+            keys = (["pH"] if self.has_ph else []) + (["ec"] if self.has_ec else [])
+            reads.append(self.read_or_none(self.read_ezo(self.reservoir_temperature()), keys))
+        if self.temperature is not None and (self.has_temp or self.has_reservoir_temp):
+            keys = ["temperature_" + name[len("DS18B20_"):] for name in self.ds18b20_names()]
+            reads.append(self.read_or_none(self.read_all_ds18b20(), keys))
+        results = await uasyncio.gather(*reads)
+        for result in results:
+            data.update(result)
+        if self.has_water_level:
+            data["water_level"] = await self.read_water_level()
         return data
 
+    # Input: Coroutine returning a dictionary of readings and the keys it fills
+    # Output: The readings, or None for each key when the read failed, so one sensor failing does not lose
+    #         the readings of the others
+    async def read_or_none(self, read, keys):
+        try:
+            return await read
+        except Exception as e:
+            self.logger.error("Failed to read " + ", ".join(keys) + ": " + str(e))
+            return {key: None for key in keys}
 
-    def check_phase(self, shelf):
-
-        # Get current time
-        current_time = machine.RTC().datetime()
-
-        if shelf == "lower":
-            shelf_phase = self.configs["date"]["lower_grow_start_date"]
-
-        if shelf == "upper":
-            shelf_phase = self.configs["date"]["upper_grow_start_date"]
-
-        cleaned = shelf_phase.split(",")
-        time_list = []
-        for num in cleaned:
-            time_list.append(int(num))
-
-        sec_elapsed = mktime(current_time) - mktime(time_list)
-        days_elapsed = sec_elapsed / (24 * 60 * 60)
-
-        if days_elapsed <= self.configs["phase"]["germ"]["length_in_days"]:
-            phase = "germ"
-        elif days_elapsed <= self.configs["phase"]["veg"]["length_in_days"]:
-            phase = "veg"
-        else:
-            phase = "bloom"
-
-        return phase
 
     def turn_lights_on(self, grow_phase, shelf):
 
@@ -247,53 +340,45 @@ class DeviceHandler:
             self.pins["light_upper_inner"].off()
             self.pins["light_upper_outer"].off()
 
+    # Switches the lights of any shelf whose scheduled transition has passed
+    @timed("check_lights")
     def check_lights(self):
-        shelves = ["upper", "lower"]
-        for shelf in shelves:
-            phase = self.check_phase(shelf)
-
-            light_off_duration = 24 - self.configs["phase"][phase]["light_hours"]
-
-            current_time = machine.RTC().datetime()
-            current_hour = current_time[4]
-
-            if current_hour == self.configs["light_trigger_hour"]:
-                self.logger.log("Turn " + shelf + " light off")
-                self.turn_lights_off(phase, shelf)
-            elif current_hour == (self.configs["light_trigger_hour"] + light_off_duration):
-                self.logger.log("Turn " + shelf + " light on")
-                self.turn_lights_on(phase, shelf)
-
-    def check_pump(self):
-        if self.read_pressure() < 80:
-            while self.read_pressure() < 100:
-                 self.turn_on_pump()
-            self.turn_off_pump()
+        self.light_scheduler.update()
+
+    @timed_async("check_pump")
+    async def check_pump(self):
+        await self.pump_controller.check()
+
+    @timed_async("check_fans")
+    async def check_fans(self):
+        plant_pins = [pin for pin in self.pins if "plant" in pin and "DHT" not in pin]
+        # Reuse the temperatures from read_all_data when they are recent enough
+        plant_temps = await self.temperature.read(plant_pins, self.TEMPERATURE_MAX_AGE_MS)
+        for pin in plant_pins:
+            temperatures = plant_temps[pin]
+            # Without a reading the fans are left as they are rather than switched off as if it were cool
+            if not temperatures:
+                continue
+            measured_temperature = sum(temperatures) / 2
+            print (measured_temperature)
+            if measured_temperature > self.fan_trigger_temperature:
+                if "lower " in pin:
+                    self.pins["fan_lower"].on()
+                if "upper" in pin:
+                    self.pins["fan_upper"].on()
+            else:
+                if "lower " in pin:
+                    self.pins["fan_lower"].off()
+                if "upper" in pin:
+                    self.pins["fan_upper"].off()
 
-    def check_fans(self):
-        for pin in self.pins:
-            if "plant" in pin and "DHT" not in pin:
-                temperatures = self.read_ds18b20(pin)
-                measured_temperature = sum(temperatures) / 2
-                print (measured_temperature)
-                if measured_temperature > self.configs["fan_trigger_temperature"]:
-                    if "lower " in pin:
-                        self.pins["fan_lower"].on()
-                    if "upper" in pin:
-                        self.pins["fan_upper"].on()
-                else:
-                    if "lower " in pin:
-                        self.pins["fan_lower"].off()
-                    if "upper" in pin:
-                        self.pins["fan_upper"].off()
-
-    def test_pump(self):
+    async def test_pump(self):
         self.pins["main_pump"].on()
-        sleep(10)
+        await uasyncio.sleep(10)
         self.pins["main_pump"].off()
 
-    def test_solenoids(self):
-        self.open_close_solenoids()
+    async def test_solenoids(self):
+        await self.open_close_solenoids()
 
     def turn_off_pump(self):
         self.pins["main_pump"].on()
@@ -392,14 +477,14 @@ class DeviceHandler:
 
 
 
-    def p_pump_on(self):
+    async def p_pump_on(self):
         p_pump = []
         for pump in ["p_pump1", "p_pump2", "p_pump3", "p_pump4", "p_pump5"]:
             p_pump.append(self.pins[pump])
         for pump in p_pump:
             print(pump)
             pump.on()
-            sleep(3)
+            await uasyncio.sleep(3)
             pump.off()
     
     def p_pump_off(self, pump_num):
@@ -446,11 +531,11 @@ class DeviceHandler:
     
     
     
-    def stirrer_on(self, stirrer_num):
+    async def stirrer_on(self, stirrer_num):
         stirrer_str = "stirrer_" + str(stirrer_num)
         # Set the current high on startup
         self.PWM[stirrer_str].duty(900)
-        sleep_ms(400)
+        await uasyncio.sleep_ms(400)
         self.PWM[stirrer_str].duty(500)
     
     def stirrer_off(self, stirrer_num):
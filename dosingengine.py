@@ -0,0 +1,153 @@
+# This class handles dosing jobs of the peristaltic pumps, running the steps of a job concurrently
+import uasyncio
+from time import ticks_ms, ticks_add, ticks_diff
+from logger import Logger
+from pumpcalibration import PumpCalibration
+
+class DosingEngine:
+
+    ESP_LOG_FILE = "esp_log.txt"
+    # Seconds the containers are stirred before their pumps start
+    STIR_TIME = 15
+    # Seconds the circulation pump keeps mixing the reservoir after the last pump stops
+    MIX_TIME = 15
+    # mL of each nutrient per dose when the caller does not give a volume
+    NUTRIENT_ML = 2.0
+    # mL of water per top-up, the old 907 second run
+    WATER_ML = 1500
+    # Most milliseconds a pump is switched off ahead of its deadline to make up for a late event loop
+    MAX_WAKE_LATENESS = 50
+    # Peristaltic pumps allowed to run at the same time
+    MAX_PUMPS = 2
+
+    # Input: DeviceHandler driving the pumps, stirrers and circulation pump, and the optional "dosing" and
+    #        "pump_calibration" sections of the board config
+    def __init__(self, device_handler, configs=None, calibration=None):
+        if configs is None:
+            configs = {}
+        self.logger = Logger(self.ESP_LOG_FILE)
+        self.device_handler = device_handler
+        self.stir_time = configs.get("stir_time", self.STIR_TIME)
+        self.mix_time = configs.get("mix_time", self.MIX_TIME)
+        self.nutrient_ml = configs.get("nutrient_ml", self.NUTRIENT_ML)
+        self.water_ml = configs.get("water_ml", self.WATER_ML)
+        self.calibration = PumpCalibration(calibration)
+        self.max_pumps = configs.get("max_pumps", self.MAX_PUMPS)
+        if self.max_pumps < 1:
+            raise ValueError("Dosing max_pumps has to be at least 1")
+        # Jobs share the circulation pump, so one runs at a time
+        self.lock = uasyncio.Lock()
+        self.jobs = 0
+        # Milliseconds the event loop has been waking pump_for after its deadline, learned from the
+        # measured on-times and subtracted from the next sleep so doses do not run long
+        self.wake_lateness = 0
+        # Ticks at which the last job or top-up ended, the probes read the reservoir only once it has settled
+        self.finished_at = None
+
+    def has_stirrer(self, pump_num):
+        return ("stirrer_" + str(pump_num)) in self.device_handler.PWM
+
+    # Input: List of (pump number, seconds to run)
+    # Output: Tuple of (list of (start, end, pump number) in seconds from the start of the job, job length)
+    # Every container with a stirrer is stirred from the start of the job and its pump starts once the
+    # stirring time has passed and fewer than max_pumps pumps are running
+    def plan(self, doses):
+        first_start = 0
+        for pump_num, seconds in doses:
+            if self.has_stirrer(pump_num):
+                first_start = self.stir_time
+        # Time at which each pump slot becomes free
+        slots = [first_start] * self.max_pumps
+        timeline = []
+        last_end = first_start
+        for pump_num, seconds in doses:
+            slot = slots.index(min(slots))
+            start = slots[slot]
+            end = start + seconds
+            slots[slot] = end
+            timeline.append((start, end, pump_num))
+            if end > last_end:
+                last_end = end
+        return timeline, last_end + self.mix_time
+
+    async def _sleep_until(self, origin, seconds):
+        delay = ticks_diff(ticks_add(origin, int(seconds * 1000)), ticks_ms())
+        if delay > 0:
+            await uasyncio.sleep_ms(delay)
+
+    # Input: Pump number and on-time in milliseconds
+    # Output: Measured on-time in milliseconds
+    async def pump_for(self, pump_num, ms):
+        pump = self.device_handler.pins["p_pump" + str(pump_num)]
+        pump.on()
+        start = ticks_ms()
+        deadline = ticks_add(start, ms)
+        try:
+            remaining = ms - self.wake_lateness
+            while remaining > 0:
+                await uasyncio.sleep_ms(remaining)
+                remaining = ticks_diff(deadline, ticks_ms()) - self.wake_lateness
+        finally:
+            pump.off()
+        elapsed = ticks_diff(ticks_ms(), start)
+        lateness = self.wake_lateness + (elapsed - ms) // 2
+        self.wake_lateness = min(self.MAX_WAKE_LATENESS, max(0, lateness))
+        return elapsed
+
+    async def _dose(self, origin, start, end, pump_num):
+        await self._sleep_until(origin, start)
+        if self.has_stirrer(pump_num):
+            self.device_handler.stirrer_off(pump_num)
+        await self.pump_for(pump_num, int((end - start) * 1000))
+
+    # Input: List of (pump number, seconds to run)
+    # Output: Length of the job in seconds
+    # Runs the job as planned by plan() with the circulation pump on throughout
+    async def run(self, doses):
+        async with self.lock:
+            timeline, length = self.plan(doses)
+            origin = ticks_ms()
+            self.device_handler.circulation_pump_on()
+            try:
+                await uasyncio.gather(*[self.device_handler.stirrer_on(step[2]) for step in timeline
+                    if self.has_stirrer(step[2])])
+                await uasyncio.gather(*[self._dose(origin, step[0], step[1], step[2]) for step in timeline])
+                await self._sleep_until(origin, length)
+            finally:
+                for step in timeline:
+                    self.device_handler.p_pump_off(step[2])
+                    if self.has_stirrer(step[2]):
+                        self.device_handler.stirrer_off(step[2])
+                self.device_handler.circulation_pump_off()
+            self.jobs += 1
+            self.finished_at = ticks_ms()
+            elapsed = ticks_diff(ticks_ms(), origin)
+        self.logger.log("Dosed " + str(timeline) + " in " + str(elapsed) + " ms")
+        return elapsed / 1000
+
+    # Input: List of (pump number, mL), the volume defaults to nutrient_ml
+    # Output: Length of the job in seconds
+    async def dose_ml(self, doses):
+        timed_doses = []
+        for dose in doses:
+            ml = dose[1] if len(dose) > 1 else self.nutrient_ml
+            timed_doses.append((dose[0], self.calibration.on_time_ms(dose[0], ml) / 1000))
+        return await self.run(timed_doses)
+
+    # Input: mL of water, defaults to water_ml
+    # Output: None
+    # Waits for any running job, a top-up would otherwise share the circulation pump with it
+    async def add_water(self, ml=None):
+        if ml is None:
+            ml = self.water_ml
+        async with self.lock:
+            ms = await self.pump_for(6, self.calibration.on_time_ms(6, ml))
+            self.finished_at = ticks_ms()
+        self.logger.log("Added " + str(self.calibration.volume_ml(6, ms)) + " mL of water in " + str(ms) + " ms")
+
+    # Input: Pump number and seconds to run it
+    # Output: Measured on-time in milliseconds
+    # Runs a single pump into a measuring cup, the measured volume divided by the on-time gives ml_per_s
+    async def calibrate(self, pump_num, seconds):
+        async with self.lock:
+            return await self.pump_for(pump_num, int(seconds * 1000))
@@ -0,0 +1,42 @@
+# This module handles the sensor drivers, importing each one only when the board uses it
+#
+# A driver is needed when one of its capabilities is enabled in the boards esp_type (or it has no
+# capabilities) and the boards pin map has a pin starting with the drivers pin prefix (or it has no
+# prefix). Boards never import the modules, or the one-wire and DHT firmware modules behind them,
+# for sensors they do not have.
+
+# Driver name to (module, esp_type capabilities using it, pin name prefix it needs)
+DRIVERS = {
+    "ds18b20": ("temperature", ("temp_reader", "reservoir_temp_reader", "fans"), "DS18B20"),
+    "hcsr04": ("hcsr04", ("water_level",), "ultrasonic_"),
+    "pressure": ("pressure", ("pressure_reader", "pump"), "pressure_sensor"),
+    "ezo": ("ezo", ("pH_reader", "ec_reader", "nutrient_controller"), None),
+    "dht22": ("dht", (), "DHT")
+}
+
+# Driver name to imported module
+loaded = {}
+
+# Input: Board section of the config and a driver name
+# Output: True when the board uses the driver
+def needed(configs, name):
+    capabilities = DRIVERS[name][1]
+    prefix = DRIVERS[name][2]
+    esp_type = configs["esp_type"]
+    if capabilities and not any(esp_type.get(capability) for capability in capabilities):
+        return False
+    if prefix is None:
+        return True
+    for pin in configs["pin"]:
+        if pin.startswith(prefix):
+            return True
+    return False
+
+# Input: Driver name
+# Output: The drivers module, imported on first use
+def load(name):
+    module = loaded.get(name)
+    if module is None:
+        module = __import__(DRIVERS[name][0])
+        loaded[name] = module
+    return module
@@ -0,0 +1,133 @@
+# This class handles the nutrient strength of the reservoir, dosing nutrients 1-3 up to the EC of the grow phase
+from time import time, mktime, ticks_ms, ticks_diff
+from logger import Logger
+
+DAY = 24 * 60 * 60
+HOUR_MS = 60 * 60 * 1000
+
+class ECController:
+
+    ESP_LOG_FILE = "esp_log.txt"
+    NUTRIENT_PUMPS = (1, 2, 3)
+    # Parts of nutrients 1, 2 and 3 in every dose
+    RATIO = (1, 1, 1)
+    # EC in uS/cm below the target of the phase that is left alone
+    TOLERANCE = 100
+    # mL of nutrients 1-3 together raising the reservoir by 1 uS/cm, the backup added 6 mL per 1.5 L top-up
+    ML_PER_EC = 0.01
+    # Least mL of any one nutrient per dose, shorter runs are mostly the pump lag
+    MIN_ML = 0.5
+    # Most mL of nutrients 1-3 together per dose
+    MAX_ML = 15.0
+    # Most mL of nutrients 1-3 together within an hour, so a probe stuck low cannot empty the containers
+    MAX_ML_PER_HOUR = 15.0
+    # Least rise in uS/cm after a dose that is told apart from probe noise when learning ml_per_ec
+    MIN_CHANGE = 10
+    # Bounds of the learned mL per uS/cm relative to the configured one
+    GAIN_LIMITS = (0.5, 2.0)
+    # Seconds after any dose or top-up before the EC is read again
+    SETTLE_TIME = 600
+
+    # Input: DeviceHandler reading the EC probe, DosingEngine driving the pumps and the board section of the
+    #        config, whose phases set target_ec and whose optional "ec" section sets the rest
+    def __init__(self, device_handler, dosing_engine, configs):
+        ec_configs = configs.get("ec", {})
+        self.logger = Logger(self.ESP_LOG_FILE)
+        self.device_handler = device_handler
+        self.dosing_engine = dosing_engine
+        self.targets = {}
+        for phase in ("germ", "veg", "bloom"):
+            if "target_ec" not in configs["phase"][phase]:
+                raise ValueError("EC control needs target_ec in phase " + phase)
+            self.targets[phase] = configs["phase"][phase]["target_ec"]
+        self.germ_days = configs["phase"]["germ"]["length_in_days"]
+        self.veg_days = configs["phase"]["veg"]["length_in_days"]
+        # The shelves share the reservoir, so it is mixed for the shelf that started last, whose plants take
+        # the weakest solution
+        self.start = max(mktime(date) for date in configs["date"].values())
+        ratio = ec_configs.get("ratio", self.RATIO)
+        if len(ratio) != len(self.NUTRIENT_PUMPS) or sum(ratio) <= 0:
+            raise ValueError("EC ratio needs a part for each of nutrients 1-3")
+        self.ratio = [part / sum(ratio) for part in ratio]
+        self.tolerance = ec_configs.get("tolerance", self.TOLERANCE)
+        self.configured_ml_per_ec = ec_configs.get("ml_per_ec", self.ML_PER_EC)
+        self.ml_per_ec = self.configured_ml_per_ec
+        self.min_ml = ec_configs.get("min_ml", self.MIN_ML)
+        self.max_ml = ec_configs.get("max_ml", self.MAX_ML)
+        self.max_ml_per_hour = ec_configs.get("max_ml_per_hour", self.MAX_ML_PER_HOUR)
+        self.settle_ms = int(ec_configs.get("settle_time", self.SETTLE_TIME) * 1000)
+        # List of (ticks, mL) of the doses in the last hour
+        self.history = []
+        # (mL, EC before the dose, ticks the dosing job ended) of the last dose, checked against the next reading
+        self.last_dose = None
+        self.doses = 0
+
+    def dosed_last_hour(self, now):
+        self.history = [dose for dose in self.history if ticks_diff(now, dose[0]) < HOUR_MS]
+        return sum(dose[1] for dose in self.history)
+
+    # Input: EC read after the last dose had settled
+    # Output: None
+    # Moves ml_per_ec toward what the last dose achieved, so the next dose lands closer to the target
+    def learn(self, ec):
+        ml, before, finished_at = self.last_dose
+        self.last_dose = None
+        # A top-up or another job since the dose diluted or changed the reservoir, so the rise says nothing
+        if self.dosing_engine.finished_at != finished_at:
+            return
+        change = ec - before
+        if change <= self.MIN_CHANGE:
+            return
+        low = self.configured_ml_per_ec * self.GAIN_LIMITS[0]
+        high = self.configured_ml_per_ec * self.GAIN_LIMITS[1]
+        self.ml_per_ec = min(high, max(low, (self.ml_per_ec + ml / change) / 2))
+
+    # Input: Time in seconds
+    # Output: Grow phase of the reservoir at that time
+    def phase_at(self, t):
+        days = (t - self.start) / DAY
+        if days < self.germ_days:
+            return "germ"
+        elif days < self.veg_days:
+            return "veg"
+        return "bloom"
+
+    # Input: None
+    # Output: mL dosed, 0 when the EC is close enough to the target, the reservoir is still settling, the
+    #         smallest part of the dose would be below min_ml or the hourly limit is reached
+    # Reads the EC once and doses nutrients 1-3 in their ratio for the gap to the target
+    async def check(self):
+        now = ticks_ms()
+        finished_at = self.dosing_engine.finished_at
+        if finished_at is not None and ticks_diff(now, finished_at) < self.settle_ms:
+            return 0
+        ec = await self.device_handler.read_ec(self.device_handler.reservoir_temperature())
+        if ec is None:
+            return 0
+        ec = float(ec)
+        if self.last_dose is not None:
+            self.learn(ec)
+        phase = self.phase_at(time())
+        gap = self.targets[phase] - ec
+        if gap <= self.tolerance:
+            return 0
+        needed = min(self.max_ml, gap * self.ml_per_ec)
+        ml = min(needed, self.max_ml_per_hour - self.dosed_last_hour(now))
+        # Every part is dosed or none is, dropping only the parts below min_ml would break the ratio
+        smallest = min(part for part in self.ratio if part > 0)
+        if ml * smallest < self.min_ml:
+            if needed * smallest < self.min_ml:
+                reason = "gap too small to dose"
+            else:
+                reason = "hourly limit reached"
+            self.logger.log("EC " + str(ec) + " below " + str(self.targets[phase]) + ", " + reason)
+            return 0
+        doses = [(self.NUTRIENT_PUMPS[i], ml * self.ratio[i]) for i in range(len(self.NUTRIENT_PUMPS))
+            if self.ratio[i] > 0]
+        await self.dosing_engine.dose_ml(doses)
+        self.history.append((ticks_ms(), ml))
+        self.last_dose = (ml, ec, self.dosing_engine.finished_at)
+        self.doses += 1
+        self.logger.log("EC " + str(ec) + " below " + str(self.targets[phase]) + " for " + phase + ", dosed "
+            + str(round(ml, 2)) + " mL of nutrients")
+        return ml
@@ -0,0 +1,174 @@
+# This class handles the Atlas Scientific EZO pH and EC circuits over I2C
+import uasyncio
+from time import ticks_ms, ticks_diff
+
+# Response status codes sent as the first byte of every EZO reply
+STATUS_SUCCESS = 1
+STATUS_SYNTAX_ERROR = 2
+STATUS_PENDING = 254
+STATUS_NO_DATA = 255
+
+# Interval at which a pending conversion is polled once its nominal time has passed
+POLL_MS = 20
+COMMA = 44
+PERIOD = 46
+MINUS = 45
+
+# Input: Response buffer and preallocated list of values
+# Output: Number of values parsed
+# Parses the comma separated decimals of an EZO reply without decoding or splitting strings
+def parse_values(buf, values):
+    count = 0
+    value = 0
+    divisor = 1
+    negative = False
+    fraction = False
+    digits = False
+    for i in range(1, len(buf)):
+        c = buf[i]
+        if 48 <= c <= 57:
+            value = value * 10 + c - 48
+            digits = True
+            if fraction:
+                divisor *= 10
+        elif c == PERIOD:
+            fraction = True
+        elif c == MINUS:
+            negative = True
+        elif c == COMMA or c == 0:
+            if digits and count < len(values):
+                values[count] = (-value if negative else value) / divisor
+                count += 1
+            value = 0
+            divisor = 1
+            negative = False
+            fraction = False
+            digits = False
+            if c == 0:
+                break
+    return count
+
+class EZOSensor:
+
+    # Processing time of a reading in ms, from the EZO datasheets
+    PH_READ_MS = 900
+    EC_READ_MS = 600
+    STATUS_MS = 300
+    RESPONSE_SIZE = 32
+
+    def __init__(self, i2c, address, read_ms, num_values=1):
+        self.i2c = i2c
+        self.address = address
+        self.read_ms = read_ms
+        # Reply buffer and parsed values are allocated once and reused for every reading
+        self.buf = bytearray(self.RESPONSE_SIZE)
+        self.values = [0.0] * num_values
+        self.requested_at = None
+        self.continuous = False
+        self.temperature = None
+
+    # Input: Optional temperature in C for a compensated reading
+    # Output: None
+    # Sends 'R', or 'RT,<temp>' when a temperature is given, and returns without waiting
+    def request_read(self, temperature=None):
+        if temperature is None:
+            self.i2c.writeto(self.address, b"R")
+        else:
+            self.i2c.writeto(self.address, "RT," + "{:.1f}".format(temperature))
+        self.requested_at = ticks_ms()
+
+    def remaining_ms(self):
+        if self.requested_at is None:
+            return 0
+        return max(0, self.read_ms - ticks_diff(ticks_ms(), self.requested_at))
+
+    # Input: None
+    # Output: Status byte of the reply
+    # Reads the reply into the preallocated buffer and parses it on success
+    def poll(self):
+        self.i2c.readfrom_into(self.address, self.buf)
+        status = self.buf[0]
+        if status == STATUS_SUCCESS:
+            parse_values(self.buf, self.values)
+            self.requested_at = None
+        return status
+
+    # Input: None
+    # Output: First value of the reply
+    # Waits for the requested reading and polls the status byte until it is ready
+    async def collect(self):
+        await uasyncio.sleep_ms(self.remaining_ms())
+        waited = 0
+        status = self.poll()
+        while status == STATUS_PENDING and waited < self.read_ms:
+            await uasyncio.sleep_ms(POLL_MS)
+            waited += POLL_MS
+            status = self.poll()
+        if status != STATUS_SUCCESS:
+            self.requested_at = None
+            raise OSError("EZO " + str(self.address) + " returned status " + str(status))
+        if self.continuous:
+            self.request_read(self.temperature)
+        return self.values[0]
+
+    async def read(self, temperature=None):
+        if self.requested_at is None or not self.continuous:
+            self.request_read(temperature)
+        return await self.collect()
+
+    # Input: Optional temperature in C used for every compensated reading
+    # Output: None
+    # Keeps a conversion in flight at all times so read_last never has to wait
+    def start_continuous(self, temperature=None):
+        self.continuous = True
+        self.temperature = temperature
+        if self.requested_at is None:
+            self.request_read(temperature)
+
+    def stop_continuous(self):
+        self.continuous = False
+
+    # Input: None
+    # Output: Most recent value
+    # Collects the in-flight conversion if it has finished, otherwise returns the last value
+    def read_last(self):
+        if self.requested_at is not None and self.remaining_ms() == 0:
+            if self.poll() == STATUS_SUCCESS and self.continuous:
+                self.request_read(self.temperature)
+        return self.values[0]
+
+    # Input: None
+    # Output: Tuple of the last restart reason and the supply voltage
+    async def status(self):
+        self.i2c.writeto(self.address, b"Status")
+        await uasyncio.sleep_ms(self.STATUS_MS)
+        self.i2c.readfrom_into(self.address, self.buf)
+        if self.buf[0] != STATUS_SUCCESS:
+            raise OSError("EZO " + str(self.address) + " returned status " + str(self.buf[0]))
+        # Reply has the form ?STATUS,P,5.038
+        reason = chr(self.buf[9])
+        voltage = [0.0]
+        parse_values(self.buf[10:], voltage)
+        return reason, voltage[0]
+
+# Input: List of EZO sensors and optional temperature in C
+# Output: List of the first value of each sensor, or the OSError of a sensor that failed, so one circuit
+#         failing does not lose the readings of the others
+# Requests a reading from every sensor together so they share a single conversion wait
+async def read_all(sensors, temperature=None):
+    results = [None] * len(sensors)
+    for i in range(len(sensors)):
+        sensor = sensors[i]
+        try:
+            if sensor.requested_at is None or not sensor.continuous:
+                sensor.request_read(temperature)
+        except OSError as e:
+            results[i] = e
+    for i in range(len(sensors)):
+        if results[i] is not None:
+            continue
+        try:
+            results[i] = await sensors[i].collect()
+        except OSError as e:
+            results[i] = e
+    return results
@@ -0,0 +1,220 @@
+# This class handles HTTP requests over a single persistent (keep-alive) connection
+import usocket
+import ussl
+import ujson
+
+class Response:
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return ujson.loads(self.content)
+
+class HTTPSession:
+
+    # Sockets block the event loop, so a dead link has to fail within a few seconds instead of stalling every
+    # task, e.g. the pressure sampling while the pump runs
+    # Seconds a read may wait for the server
+    DEFAULT_TIMEOUT = 3
+    # Seconds the TCP connect and the TLS handshake may take
+    CONNECT_TIMEOUT = 3
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, connect_timeout=CONNECT_TIMEOUT):
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.sock = None
+        self.address = None
+        self.connects = 0
+        # (host, port) to resolved address, a DNS lookup cannot be given a timeout so it is done once per host
+        self.addresses = {}
+
+    # Input: URL
+    # Output: Tuple of (scheme, host, port, path)
+    def parse_url(self, url):
+        try:
+            proto, _, host, path = url.split("/", 3)
+        except ValueError:
+            proto, _, host = url.split("/", 2)
+            path = ""
+        if proto == "https:":
+            port = 443
+        elif proto == "http:":
+            port = 80
+        else:
+            raise ValueError("Unsupported protocol: " + proto)
+        if ":" in host:
+            host, port = host.split(":", 1)
+            port = int(port)
+        return proto, host, port, "/" + path
+
+    def resolve(self, host, port):
+        addr = self.addresses.get((host, port))
+        if addr is None:
+            addr = usocket.getaddrinfo(host, port, 0, usocket.SOCK_STREAM)[0]
+            self.addresses[(host, port)] = addr
+        return addr
+
+    def connect(self, proto, host, port):
+        self.close()
+        addr = self.resolve(host, port)
+        raw = usocket.socket(addr[0], addr[1], addr[2])
+        raw.settimeout(self.connect_timeout)
+        sock = raw
+        try:
+            sock.connect(addr[-1])
+            if proto == "https:":
+                sock = ussl.wrap_socket(sock, server_hostname=host)
+            raw.settimeout(self.timeout)
+        except OSError:
+            sock.close()
+            # The host may have moved, look it up again on the next connect
+            self.addresses.pop((host, port), None)
+            raise
+        self.sock = sock
+        self.address = (proto, host, port)
+        self.connects += 1
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.address = None
+
+    def _send(self, method, host, path, data, headers):
+        sock = self.sock
+        sock.write(method + " " + path + " HTTP/1.1\r\nHost: " + host + "\r\nConnection: keep-alive\r\n")
+        for key in headers:
+            sock.write(key + ": " + headers[key] + "\r\n")
+        if data is not None:
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            sock.write("Content-Length: " + str(len(data)) + "\r\n\r\n")
+            sock.write(data)
+        else:
+            sock.write("\r\n")
+
+    def _read_exact(self, length):
+        content = b""
+        while len(content) < length:
+            chunk = self.sock.read(length - len(content))
+            if not chunk:
+                raise OSError("Connection closed mid response")
+            content += chunk
+        return content
+
+    def _read_chunked(self):
+        sock = self.sock
+        content = b""
+        while True:
+            line = sock.readline()
+            if not line:
+                raise OSError("Connection closed mid response")
+            size = int(line.split(b";", 1)[0].strip(), 16)
+            if size == 0:
+                break
+            content += self._read_exact(size)
+            sock.readline()
+        # Skip the trailer up to the blank line ending the response
+        while True:
+            line = sock.readline()
+            if not line or line == b"\r\n":
+                break
+        return content
+
+    # Output: Response, or None when the server closed the connection before sending any of it
+    def _receive(self):
+        sock = self.sock
+        while True:
+            line = sock.readline()
+            if not line:
+                return None
+            status_code = int(line.split(None, 2)[1])
+            length = None
+            chunked = False
+            keep_alive = True
+            while True:
+                line = sock.readline()
+                if not line or line == b"\r\n":
+                    break
+                lower = line.lower()
+                if lower.startswith(b"content-length:"):
+                    length = int(line[15:].strip())
+                elif lower.startswith(b"connection:") and b"close" in lower:
+                    keep_alive = False
+                elif lower.startswith(b"transfer-encoding:") and b"chunked" in lower:
+                    chunked = True
+            # A 1xx is an interim response without a body, the final response follows it
+            if status_code >= 200:
+                break
+        if status_code in (204, 304):
+            # These never have a body, whatever their headers say
+            content = b""
+        elif chunked:
+            content = self._read_chunked()
+        elif length is not None:
+            content = self._read_exact(length)
+        elif not keep_alive:
+            # The server closes the connection at the end of the body
+            content = sock.read()
+        else:
+            # Reading until the server closes an open connection would wait for the timeout
+            raise OSError("Response has no Content-Length")
+        if not keep_alive:
+            self.close()
+        return Response(status_code, content)
+
+    # Input: HTTP method, URL, optional body and header dictionary
+    # Output: Response with the whole body read
+    # Reuses the open connection to the same host and reconnects once if it has gone stale
+    # A stale connection fails on sending or is closed before any response byte arrives, any later error
+    # (e.g. a read timeout) may come after the server acted on the request, so it is not retried
+    def request(self, method, url, data=None, headers=None):
+        if headers is None:
+            headers = {}
+        proto, host, port, path = self.parse_url(url)
+        reused = self.sock is not None and self.address == (proto, host, port)
+        if not reused:
+            self.connect(proto, host, port)
+        response = self._attempt(method, host, path, data, headers, reused)
+        if response is not None:
+            return response
+        # The server closed the idle connection, retry once on a fresh one
+        self.connect(proto, host, port)
+        return self._attempt(method, host, path, data, headers, False)
+
+    # Output: Response, or None when the request failed on a stale connection and can be resent
+    def _attempt(self, method, host, path, data, headers, retry):
+        try:
+            self._send(method, host, path, data, headers)
+        except OSError:
+            self.close()
+            if retry:
+                return None
+            raise
+        try:
+            response = self._receive()
+        except OSError:
+            self.close()
+            raise
+        except (ValueError, IndexError):
+            # A malformed status line, length or chunk size leaves the connection in an unknown state
+            self.close()
+            raise OSError("Malformed response")
+        if response is None:
+            self.close()
+            if retry:
+                return None
+            raise OSError("Connection closed by server")
+        return response
+
+    def put(self, url, data=None, headers=None):
+        return self.request("PUT", url, data, headers)
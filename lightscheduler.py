@@ -0,0 +1,110 @@
+# This class handles the shelf lights, switching them at transition times computed ahead of time
+import uasyncio
+from time import time, mktime, ticks_ms, ticks_add, ticks_diff
+from logger import Logger
+
+DAY = 24 * 60 * 60
+HOUR = 60 * 60
+
+class LightScheduler:
+
+    ESP_LOG_FILE = "esp_log.txt"
+    SHELVES = ("upper", "lower")
+    # Longest sleep between checks, so a clock corrected by NTP after boot is picked up within the hour
+    MAX_SLEEP = HOUR
+
+    # Input: Board section of the config and the functions switching a shelfs lights, both called with
+    #        (grow phase, shelf)
+    def __init__(self, configs, lights_on, lights_off):
+        self.logger = Logger(self.ESP_LOG_FILE)
+        self.lights_on = lights_on
+        self.lights_off = lights_off
+        self.trigger_hour = configs["light_trigger_hour"]
+        self.light_hours = {}
+        for phase in ("germ", "veg", "bloom"):
+            self.light_hours[phase] = configs["phase"][phase]["light_hours"]
+        self.germ_days = configs["phase"]["germ"]["length_in_days"]
+        self.veg_days = configs["phase"]["veg"]["length_in_days"]
+        # Grow start of each shelf in seconds, the dates are tuples once the config is loaded
+        self.start = {}
+        for shelf in self.SHELVES:
+            self.start[shelf] = mktime(configs["date"][shelf + "_grow_start_date"])
+        # Shelf to (grow phase, lights on, time the entry is valid until) as last applied
+        self.schedule = {}
+        self.computed_at = None
+
+    # Input: Shelf and time in seconds
+    # Output: Grow phase of the shelf at that time
+    def phase_at(self, shelf, t):
+        days = (t - self.start[shelf]) / DAY
+        if days < self.germ_days:
+            return "germ"
+        elif days < self.veg_days:
+            return "veg"
+        return "bloom"
+
+    # Input: Shelf and time in seconds
+    # Output: Tuple of (grow phase, lights on, time of the next transition)
+    # The lights go off at light_trigger_hour and come back on after the 24 - light_hours dark hours of the phase
+    def state_at(self, shelf, t):
+        phase = self.phase_at(shelf, t)
+        off_time = t - t % DAY + self.trigger_hour * HOUR
+        if off_time > t:
+            off_time -= DAY
+        on_time = off_time + (24 - self.light_hours[phase]) * HOUR
+        lights_on = t >= on_time
+        next_time = off_time + DAY if lights_on else on_time
+        # The phase changes the on time and which lights are used
+        for boundary in (self.germ_days, self.veg_days):
+            boundary = self.start[shelf] + boundary * DAY
+            if t < boundary < next_time:
+                next_time = boundary
+        return phase, lights_on, next_time
+
+    def apply(self, shelf, phase, lights_on):
+        if lights_on:
+            # Switch everything off first so lights not used in the new phase do not stay on
+            self.lights_off(phase, shelf)
+            self.lights_on(phase, shelf)
+        else:
+            self.lights_off(phase, shelf)
+        self.logger.log("Lights " + shelf + " " + ("on" if lights_on else "off") + ", phase " + phase)
+
+    # Input: True to switch every shelf to its scheduled state, as done right after boot
+    # Output: None
+    # Recomputes and applies the state of the shelves whose next transition has passed
+    def update(self, force=False):
+        now = time()
+        # A clock set backwards invalidates the cached transitions
+        if self.computed_at is not None and now < self.computed_at:
+            force = True
+        self.computed_at = now
+        for shelf in self.SHELVES:
+            cached = self.schedule.get(shelf)
+            if not force and cached is not None and now < cached[2]:
+                continue
+            phase, lights_on, next_time = self.state_at(shelf, now)
+            if force or cached is None or cached[0] != phase or cached[1] != lights_on:
+                self.apply(shelf, phase, lights_on)
+            self.schedule[shelf] = (phase, lights_on, next_time)
+
+    # Input: None
+    # Output: Seconds until the next transition of any shelf
+    def time_to_next(self):
+        now = time()
+        return min(entry[2] for entry in self.schedule.values()) - now
+
+    # Input: Optional scheduler Service recording how late each transition was switched
+    # Output: None
+    # Puts the relays in their scheduled state, then sleeps until each following transition
+    async def run(self, service=None):
+        self.update(True)
+        while True:
+            to_next = self.time_to_next()
+            sleep_ms = max(1, min(to_next, self.MAX_SLEEP)) * 1000
+            planned = ticks_add(ticks_ms(), sleep_ms)
+            await uasyncio.sleep_ms(sleep_ms)
+            self.update()
+            # Waking up for MAX_SLEEP only rechecks the clock, there is no transition to be late for
+            if service is not None and to_next <= self.MAX_SLEEP:
+                service.record_lateness(ticks_diff(ticks_ms(), planned))
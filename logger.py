@@ -1,19 +1,158 @@
 # This class handles application logging
+import os
 import machine
+from time import ticks_ms, ticks_diff
+
+# This class holds log entries in RAM until they are written to flash in one go
+class LogBuffer:
+
+    # Input: Number of entries held, seconds between timed flushes, minimum seconds between flash writes
+    def __init__(self, size, flush_interval, min_write_interval):
+        self.size = size
+        self.flush_interval_ms = int(flush_interval * 1000)
+        self.min_write_interval_ms = int(min_write_interval * 1000)
+        # Ring buffer of timestamps and messages, allocated once
+        self.times = [None] * size
+        self.lines = [None] * size
+        self.start = 0
+        self.count = 0
+        self.dropped = 0
+        self.last_write = ticks_ms()
+
+    def append(self, curr_time, log_str):
+        end = (self.start + self.count) % self.size
+        self.times[end] = curr_time
+        self.lines[end] = log_str
+        if self.count < self.size:
+            self.count += 1
+        else:
+            # Buffer is full and flash writes are capped, overwrite the oldest entry
+            self.start = (self.start + 1) % self.size
+            self.dropped += 1
+
+    def is_full(self):
+        return self.count == self.size
+
+    def flush_due(self):
+        return self.count > 0 and ticks_diff(ticks_ms(), self.last_write) >= self.flush_interval_ms
+
+    def can_write(self):
+        return ticks_diff(ticks_ms(), self.last_write) >= self.min_write_interval_ms
+
+    # Input: None
+    # Output: All buffered entries as one string, emptying the buffer
+    def drain(self):
+        out = []
+        if self.dropped:
+            out.append(str(self.times[self.start]) + " " + str(self.dropped) + " log entries dropped\n")
+            self.dropped = 0
+        for i in range(self.count):
+            pos = (self.start + i) % self.size
+            out.append(str(self.times[pos]) + " " + self.lines[pos] + "\n")
+            self.times[pos] = None
+            self.lines[pos] = None
+        self.start = 0
+        self.count = 0
+        self.last_write = ticks_ms()
+        return "".join(out)
 
 class Logger:
 
+    # Buffers shared by every Logger writing to the same file, keyed by file name
+    buffers = {}
+    # Rotation settings (max_size, generations) and cached file sizes, keyed by file name
+    rotations = {}
+    sizes = {}
+    rtc = machine.RTC()
+
     def __init__(self, file_name):
         self.file_name = file_name
 
+    # Input: File name, buffer size in entries, seconds between timed flushes, minimum seconds between flash writes
+    # Output: None
+    # Switches every Logger of file_name to buffered mode
+    @classmethod
+    def enable_buffering(cls, file_name, size=32, flush_interval=60, min_write_interval=10):
+        cls.buffers[file_name] = LogBuffer(size, flush_interval, min_write_interval)
+
+    # Input: File name, maximum size in bytes and number of rotated generations kept
+    # Output: None
+    # Rotates file_name to file_name.1 ... file_name.<generations> once it reaches max_size
+    @classmethod
+    def enable_rotation(cls, file_name, max_size=65536, generations=3):
+        cls.rotations[file_name] = (max_size, generations)
+        try:
+            # The size is read once, afterwards it is tracked from the bytes written
+            cls.sizes[file_name] = os.stat(file_name)[6]
+        except OSError:
+            cls.sizes[file_name] = 0
+
+    def _rotate(self, generations):
+        try:
+            os.remove(self.file_name + "." + str(generations))
+        except OSError:
+            pass
+        for i in range(generations - 1, 0, -1):
+            try:
+                os.rename(self.file_name + "." + str(i), self.file_name + "." + str(i + 1))
+            except OSError:
+                pass
+        try:
+            os.rename(self.file_name, self.file_name + ".1")
+        except OSError:
+            pass
+        self.sizes[self.file_name] = 0
+
+    def _write(self, text):
+        # Encoded once, so the tracked size counts bytes on flash rather than characters
+        data = text.encode("utf-8")
+        rotation = self.rotations.get(self.file_name)
+        if rotation is not None and self.sizes[self.file_name] + len(data) > rotation[0] and self.sizes[self.file_name] > 0:
+            self._rotate(rotation[1])
+        f = open(self.file_name, "ab")
+        f.write(data)
+        f.close()
+        if rotation is not None:
+            self.sizes[self.file_name] += len(data)
+
     # Input: String to be logged
     # Output: None
-    # Writes given string to log file
+    # Writes given string to log file, or to the RAM buffer in buffered mode
     def log(self, log_str):
-        curr_time = str(machine.RTC().datetime())
-        f = open(self.file_name, "a")
-        f.write(curr_time + " " + log_str + "\n")
-        f.close()
+        buffer = self.buffers.get(self.file_name)
+        if buffer is None:
+            curr_time = str(self.rtc.datetime())
+            self._write(curr_time + " " + log_str + "\n")
+            return
+        if buffer.is_full() and buffer.can_write():
+            self.flush()
+        buffer.append(self.rtc.datetime(), log_str)
+        if buffer.flush_due() and buffer.can_write():
+            self.flush()
+
+    # Input: String to be logged
+    # Output: None
+    # Logs an error and writes the buffer to flash straight away
+    def error(self, log_str):
+        self.log("ERROR " + log_str)
+        self.flush()
+
+    # Input: None
+    # Output: None
+    # Writes every buffered entry to the log file in a single write
+    def flush(self):
+        buffer = self.buffers.get(self.file_name)
+        if buffer is None or buffer.count == 0:
+            return
+        self._write(buffer.drain())
+
+    # Input: None
+    # Output: None
+    # Flushes when the timed flush interval has passed, meant to be run periodically
+    async def flush_if_due(self):
+        buffer = self.buffers.get(self.file_name)
+        if buffer is not None and buffer.flush_due() and buffer.can_write():
+            self.flush()
 
     # Input: None
     # Output: None
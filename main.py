@@ -1,4 +1,7 @@
 # Main file that gets executed
+import sys
+# Bytecode built by tools/build.py is imported ahead of any .py copies of the same modules
+sys.path.insert(0, "/mpy")
 import os 
 import machine
 from time import sleep, time
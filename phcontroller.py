@@ -0,0 +1,96 @@
+# This class handles the pH of the reservoir, dosing pH down or up in proportion to the error
+from time import ticks_ms, ticks_diff
+from logger import Logger
+
+HOUR_MS = 60 * 60 * 1000
+
+class PhController:
+
+    ESP_LOG_FILE = "esp_log.txt"
+    PH_DOWN = 4
+    PH_UP = 5
+    # Band the pH is kept in, doses aim for the middle of it
+    LOW = 5.5
+    HIGH = 6.5
+    # mL of pH down or up moving the reservoir by one pH unit, the backup used about 3.8 mL per round
+    ML_PER_PH = 4.0
+    MIN_ML = 0.5
+    MAX_ML = 5.0
+    # Most mL of each pump within an hour, so a failing probe cannot empty a container into the reservoir
+    MAX_ML_PER_HOUR = 15.0
+    # Seconds after any dose or top-up before the pH is read again, the probe needs the mixed solution to settle
+    SETTLE_TIME = 600
+    # Bounds of the learned mL per pH relative to the configured one
+    GAIN_LIMITS = (0.5, 2.0)
+
+    # Input: DeviceHandler reading the pH probe, DosingEngine driving the pumps and the optional "ph" section
+    #        of the board config
+    def __init__(self, device_handler, dosing_engine, configs=None):
+        if configs is None:
+            configs = {}
+        self.logger = Logger(self.ESP_LOG_FILE)
+        self.device_handler = device_handler
+        self.dosing_engine = dosing_engine
+        self.low = configs.get("low", self.LOW)
+        self.high = configs.get("high", self.HIGH)
+        if self.low >= self.high:
+            raise ValueError("pH low has to be below high")
+        self.target = configs.get("target", (self.low + self.high) / 2)
+        self.configured_ml_per_ph = configs.get("ml_per_ph", self.ML_PER_PH)
+        self.ml_per_ph = self.configured_ml_per_ph
+        self.min_ml = configs.get("min_ml", self.MIN_ML)
+        self.max_ml = configs.get("max_ml", self.MAX_ML)
+        self.max_ml_per_hour = configs.get("max_ml_per_hour", self.MAX_ML_PER_HOUR)
+        self.settle_ms = int(configs.get("settle_time", self.SETTLE_TIME) * 1000)
+        # Pump number to list of (ticks, mL) of the doses in the last hour
+        self.history = {self.PH_DOWN: [], self.PH_UP: []}
+        # (pump number, mL, pH before the dose) of the last dose, checked against the next reading
+        self.last_dose = None
+        self.doses = 0
+
+    def dosed_last_hour(self, pump_num, now):
+        history = [dose for dose in self.history[pump_num] if ticks_diff(now, dose[0]) < HOUR_MS]
+        self.history[pump_num] = history
+        return sum(dose[1] for dose in history)
+
+    # Input: pH read after the last dose had settled
+    # Output: None
+    # Moves ml_per_ph toward what the last dose achieved, so the next dose lands closer to the target
+    def learn(self, ph):
+        pump_num, ml, before = self.last_dose
+        self.last_dose = None
+        change = before - ph if pump_num == self.PH_DOWN else ph - before
+        if change <= 0.05:
+            return
+        low = self.configured_ml_per_ph * self.GAIN_LIMITS[0]
+        high = self.configured_ml_per_ph * self.GAIN_LIMITS[1]
+        self.ml_per_ph = min(high, max(low, (self.ml_per_ph + ml / change) / 2))
+
+    # Input: None
+    # Output: mL dosed, 0 when the pH is in the band, still settling or the hourly limit is reached
+    # Reads the pH once and doses at most once, so the nutrient task never waits on the reservoir
+    async def check(self):
+        now = ticks_ms()
+        finished_at = self.dosing_engine.finished_at
+        if finished_at is not None and ticks_diff(now, finished_at) < self.settle_ms:
+            return 0
+        ph = await self.device_handler.read_ph(self.device_handler.reservoir_temperature())
+        if ph is None:
+            return 0
+        ph = float(ph)
+        if self.last_dose is not None:
+            self.learn(ph)
+        if self.low <= ph <= self.high:
+            return 0
+        pump_num = self.PH_DOWN if ph > self.high else self.PH_UP
+        ml = min(self.max_ml, max(self.min_ml, abs(ph - self.target) * self.ml_per_ph))
+        ml = min(ml, self.max_ml_per_hour - self.dosed_last_hour(pump_num, now))
+        if ml < self.min_ml:
+            self.logger.log("pH " + str(ph) + " out of band, hourly limit of p_pump" + str(pump_num) + " reached")
+            return 0
+        await self.dosing_engine.dose_ml([(pump_num, ml)])
+        self.history[pump_num].append((ticks_ms(), ml))
+        self.last_dose = (pump_num, ml, ph)
+        self.doses += 1
+        self.logger.log("pH " + str(ph) + ", dosed " + str(round(ml, 2)) + " mL with p_pump" + str(pump_num))
+        return ml
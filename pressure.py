@@ -0,0 +1,79 @@
+# This class handles the analog pressure transducer on the irrigation tank
+import machine
+
+class PressureSensor:
+
+    ADC_MAX = 4095
+    VREF = 3.3
+    # Linear transducer calibration, pressure = GAIN * voltage + OFFSET
+    GAIN = 49.4
+    OFFSET = -10.5
+
+    DEFAULT_SAMPLES = 64
+    DEFAULT_WINDOW = 5
+    FILTERS = ("none", "moving_average", "median")
+
+    # Input: machine.Pin of the sensor and the optional "pressure" section of the board config
+    def __init__(self, pin, configs=None):
+        if configs is None:
+            configs = {}
+        self.samples = configs.get("samples", self.DEFAULT_SAMPLES)
+        self.filter = configs.get("filter", "none")
+        self.window = configs.get("window", self.DEFAULT_WINDOW)
+        if self.filter not in self.FILTERS:
+            raise ValueError("Unknown pressure filter " + str(self.filter))
+        # The ADC is configured once and reused for every read
+        self.adc = machine.ADC(pin)
+        self.adc.atten(machine.ADC.ATTN_11DB)
+        self.adc.width(machine.ADC.WIDTH_12BIT)
+        # Preallocated buffers for the filters, holding raw sample totals
+        self.history = [0] * self.window
+        self.history_len = 0
+        self.history_pos = 0
+        self.bursts = [0] * self.window
+        # Converts a raw sample total to pressure with a single multiply
+        self.scale = self.GAIN * self.VREF / (self.ADC_MAX * self.samples)
+
+    # Input: None
+    # Output: Sum of self.samples raw ADC readings
+    def read_raw(self):
+        read = self.adc.read
+        total = 0
+        for _ in range(self.samples):
+            total += read()
+        return total
+
+    def to_pressure(self, total):
+        return self.scale * total + self.OFFSET
+
+    def _moving_average(self):
+        self.history[self.history_pos] = self.read_raw()
+        self.history_pos = (self.history_pos + 1) % self.window
+        if self.history_len < self.window:
+            self.history_len += 1
+        total = 0
+        for i in range(self.history_len):
+            total += self.history[i]
+        return total / self.history_len
+
+    def _median(self):
+        for i in range(self.window):
+            self.bursts[i] = self.read_raw()
+        self.bursts.sort()
+        return self.bursts[self.window // 2]
+
+    # Input: None
+    # Output: Filtered pressure reading
+    def read(self):
+        if self.filter == "moving_average":
+            total = self._moving_average()
+        elif self.filter == "median":
+            total = self._median()
+        else:
+            total = self.read_raw()
+        return self.to_pressure(total)
+
+    # Clears the moving average history, e.g. when the pump changes state
+    def reset(self):
+        self.history_len = 0
+        self.history_pos = 0
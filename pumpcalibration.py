@@ -0,0 +1,66 @@
+# This class handles the conversion between dosed volume and on-time of the peristaltic pumps
+class PumpCalibration:
+
+    # Flow of an uncalibrated pump, 1.7 seconds gave about 2.0 mL on the nutrient pumps
+    ML_PER_S = 1.18
+
+    # Input: Optional "pump_calibration" section of the board config, with a section per pump (e.g. "p_pump1")
+    # A pump section either sets ml_per_s and lag, the seconds the pump runs before liquid reaches the outlet,
+    # or a table of measured [seconds, mL] points that is interpolated piecewise for pumps whose flow is not
+    # linear in the on-time
+    def __init__(self, configs=None):
+        if configs is None:
+            configs = {}
+        # Pump name to list of (seconds, mL) points with increasing seconds, starting at no volume
+        self.points = {}
+        for name in configs:
+            self.points[name] = self.curve(name, configs[name])
+
+    def curve(self, name, configs):
+        if "table" in configs:
+            points = [(0, 0)] + [(float(point[0]), float(point[1])) for point in configs["table"]]
+        else:
+            lag = configs.get("lag", 0)
+            ml_per_s = configs.get("ml_per_s", self.ML_PER_S)
+            points = [(0, 0), (lag + 1, ml_per_s)]
+            if lag > 0:
+                points.insert(1, (lag, 0))
+        for i in range(1, len(points)):
+            if points[i][0] <= points[i - 1][0] or points[i][1] < points[i - 1][1]:
+                raise ValueError("Calibration of " + name + " has to increase in seconds and mL")
+        if points[-1][1] <= points[-2][1]:
+            raise ValueError("Calibration of " + name + " has to end with a flowing segment")
+        return points
+
+    def pump_points(self, pump_num):
+        name = "p_pump" + str(pump_num)
+        points = self.points.get(name)
+        if points is None:
+            points = self.curve(name, {})
+            self.points[name] = points
+        return points
+
+    # Input: Pump number and volume in mL
+    # Output: On-time in milliseconds dispensing the volume, past the last point the last segment is extended
+    def on_time_ms(self, pump_num, ml):
+        if ml <= 0:
+            return 0
+        points = self.pump_points(pump_num)
+        for i in range(1, len(points)):
+            if ml <= points[i][1] or i == len(points) - 1:
+                start, end = points[i - 1], points[i]
+                if end[1] == start[1]:
+                    continue
+                seconds = start[0] + (ml - start[1]) * (end[0] - start[0]) / (end[1] - start[1])
+                return int(seconds * 1000 + 0.5)
+
+    # Input: Pump number and on-time in milliseconds
+    # Output: Volume in mL dispensed in that time
+    def volume_ml(self, pump_num, ms):
+        seconds = ms / 1000
+        points = self.pump_points(pump_num)
+        for i in range(1, len(points)):
+            if seconds <= points[i][0] or i == len(points) - 1:
+                start, end = points[i - 1], points[i]
+                ml = start[1] + (seconds - start[0]) * (end[1] - start[1]) / (end[0] - start[0])
+                return max(0, ml)
@@ -0,0 +1,140 @@
+# This class handles the main pump, keeping the irrigation tank pressure between two thresholds
+import array
+import uasyncio
+from time import ticks_ms, ticks_diff
+from logger import Logger
+
+class PumpController:
+
+    ESP_LOG_FILE = "esp_log.txt"
+    # Pressure in psi below which the pump starts and at which it stops
+    LOW_THRESHOLD = 80
+    HIGH_THRESHOLD = 100
+    # Seconds between pressure reads while the pump runs
+    SAMPLE_INTERVAL = 0.5
+    # Seconds the pump may run at once and has to rest after a run
+    MAX_RUN_TIME = 60
+    MIN_OFF_TIME = 30
+    # The pressure has to rise by MIN_RISE psi every RISE_WINDOW seconds, otherwise the pump is dry
+    # or the lines leak and the pump is locked out for FAULT_LOCKOUT seconds
+    RISE_WINDOW = 10
+    MIN_RISE = 2
+    FAULT_LOCKOUT = 600
+    # Pressure samples kept per run for the logged pressure curve
+    CURVE_SAMPLES = 64
+
+    # Input: PressureSensor, functions switching the pump on and off and the optional "pump" section
+    #        of the board config
+    def __init__(self, pressure_sensor, pump_on, pump_off, configs=None):
+        if configs is None:
+            configs = {}
+        self.logger = Logger(self.ESP_LOG_FILE)
+        self.pressure_sensor = pressure_sensor
+        self.pump_on = pump_on
+        self.pump_off = pump_off
+        self.low = configs.get("low_threshold", self.LOW_THRESHOLD)
+        self.high = configs.get("high_threshold", self.HIGH_THRESHOLD)
+        if self.low >= self.high:
+            raise ValueError("Pump low_threshold has to be below high_threshold")
+        self.sample_ms = int(configs.get("sample_interval", self.SAMPLE_INTERVAL) * 1000)
+        self.max_run_ms = int(configs.get("max_run_time", self.MAX_RUN_TIME) * 1000)
+        self.min_off_ms = int(configs.get("min_off_time", self.MIN_OFF_TIME) * 1000)
+        self.rise_window_ms = int(configs.get("rise_window", self.RISE_WINDOW) * 1000)
+        self.min_rise = configs.get("min_rise", self.MIN_RISE)
+        self.lockout_ms = int(configs.get("fault_lockout", self.FAULT_LOCKOUT) * 1000)
+        # Pressure in tenths of a psi, allocated once and reused for every run
+        self.curve = array.array("h", [0] * configs.get("curve_samples", self.CURVE_SAMPLES))
+        self.curve_len = 0
+        self.running = False
+        self.last_stop = None
+        self.fault_time = None
+        self.runs = 0
+        self.faults = 0
+        self.last_run_ms = 0
+        self.last_pressure = None
+
+    def _record(self, pressure):
+        self.last_pressure = pressure
+        if self.curve_len < len(self.curve):
+            self.curve[self.curve_len] = int(pressure * 10)
+            self.curve_len += 1
+        else:
+            # Keep the start of the run and the latest sample
+            self.curve[self.curve_len - 1] = int(pressure * 10)
+
+    # Input: None
+    # Output: Reason the pump may not start, or None
+    def blocked(self):
+        now = ticks_ms()
+        if self.fault_time is not None:
+            if ticks_diff(now, self.fault_time) < self.lockout_ms:
+                return "fault lockout"
+            self.fault_time = None
+        if self.last_stop is not None and ticks_diff(now, self.last_stop) < self.min_off_ms:
+            return "minimum off time"
+        return None
+
+    # Input: None
+    # Output: None
+    # Reads the pressure once and, when it is below the low threshold, runs the pump until it reaches
+    # the high threshold, the maximum run time passes or the pressure stops rising
+    async def check(self):
+        pressure = self.pressure_sensor.read()
+        self.last_pressure = pressure
+        if pressure >= self.low or self.running:
+            return
+        reason = self.blocked()
+        if reason is not None:
+            self.logger.log("Pressure " + str(pressure) + " below " + str(self.low) + ", pump held off: " + reason)
+            return
+        await self.run(pressure)
+
+    async def run(self, pressure):
+        self.running = True
+        self.curve_len = 0
+        self._record(pressure)
+        start = ticks_ms()
+        window_start = start
+        window_pressure = pressure
+        result = "high threshold reached"
+        fault = False
+        self.pump_on()
+        try:
+            while pressure < self.high:
+                await uasyncio.sleep_ms(self.sample_ms)
+                pressure = self.pressure_sensor.read()
+                self._record(pressure)
+                now = ticks_ms()
+                if ticks_diff(now, start) >= self.max_run_ms:
+                    result = "maximum run time reached"
+                    break
+                if ticks_diff(now, window_start) >= self.rise_window_ms:
+                    if pressure - window_pressure < self.min_rise:
+                        result = "pressure not rising"
+                        fault = True
+                        self.faults += 1
+                        self.fault_time = now
+                        break
+                    window_start = now
+                    window_pressure = pressure
+        finally:
+            self.pump_off()
+            self.running = False
+            self.last_stop = ticks_ms()
+        self.runs += 1
+        self.last_run_ms = ticks_diff(self.last_stop, start)
+        message = ("Pump ran " + str(self.last_run_ms) + " ms, " + result + ", pressure curve " +
+            str([value / 10 for value in self.curve[:self.curve_len]]))
+        if fault:
+            self.logger.error(message + ", check for a dry pump or a leak")
+        else:
+            self.logger.log(message)
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "faults": self.faults,
+            "last_run_ms": self.last_run_ms,
+            "last_pressure": self.last_pressure,
+            "locked_out": self.fault_time is not None
+        }
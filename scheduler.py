@@ -0,0 +1,153 @@
+# This class handles the cooperative scheduling of the boards periodic tasks
+import uasyncio
+from time import ticks_ms, ticks_us, ticks_add, ticks_diff
+from logger import Logger
+from timing import Timings, elapsed_us
+
+class PeriodicTask:
+
+    def __init__(self, name, fun, period, offset=0):
+        self.name = name
+        # Coroutine function that performs one run of the task
+        self.fun = fun
+        self.period_ms = int(period * 1000)
+        # Delay of the first run, so tasks sharing a period can be spread out
+        self.offset_ms = int(offset * 1000)
+        self.runs = 0
+        self.errors = 0
+        self.overruns = 0
+        self.last_lateness_ms = 0
+        self.max_lateness_ms = 0
+        self.total_lateness_ms = 0
+        # Run time of the task, so an overrun can be traced to the task that caused it
+        self.timing = Timings.get("task_" + name)
+
+    def record_lateness(self, lateness_ms):
+        self.runs += 1
+        self.last_lateness_ms = lateness_ms
+        self.total_lateness_ms += lateness_ms
+        if lateness_ms > self.max_lateness_ms:
+            self.max_lateness_ms = lateness_ms
+
+    def stats(self):
+        avg = self.total_lateness_ms // self.runs if self.runs else 0
+        return {
+            "period_ms": self.period_ms,
+            "runs": self.runs,
+            "errors": self.errors,
+            "overruns": self.overruns,
+            "last_lateness_ms": self.last_lateness_ms,
+            "avg_lateness_ms": avg,
+            "max_lateness_ms": self.max_lateness_ms
+        }
+
+class Service(PeriodicTask):
+
+    # A service times itself, so it has no period and runs counts the events it reported lateness for
+    def __init__(self, name, fun):
+        super().__init__(name, fun, 0)
+
+class Scheduler:
+
+    ESP_LOG_FILE = "esp_log.txt"
+    # Lateness above this value is written to the log
+    LATENESS_LOG_MS = 1000
+    # Seconds before a service that raised is started again
+    SERVICE_RESTART_DELAY = 60
+
+    def __init__(self):
+        self.logger = Logger(self.ESP_LOG_FILE)
+        self.tasks = []
+        # Long running coroutines that do their own timing
+        self.services = []
+        self.service_tasks = []
+        self.running = False
+
+    # Input: Task name, coroutine function, period in seconds and optional delay of the first run in seconds
+    # Output: None
+    # Registers a task to be run every period seconds
+    def add_task(self, name, fun, period, offset=0):
+        task = PeriodicTask(name, fun, period, offset)
+        # The next run is found by dividing by the period, a task without one would fail on its first run
+        if task.period_ms <= 0:
+            raise ValueError("Task " + name + " needs a period of at least 1 ms")
+        self.tasks.append(task)
+
+    async def _run_task(self, task):
+        next_run = ticks_add(ticks_ms(), task.offset_ms)
+        if task.offset_ms:
+            await uasyncio.sleep_ms(task.offset_ms)
+        while self.running:
+            lateness = ticks_diff(ticks_ms(), next_run)
+            task.record_lateness(lateness)
+            if lateness > self.LATENESS_LOG_MS:
+                self.logger.log("Task " + task.name + " late by " + str(lateness) + " ms")
+            start_us = ticks_us()
+            start_ms = ticks_ms()
+            try:
+                await task.fun()
+            except Exception as e:
+                task.errors += 1
+                self.logger.error("Task " + task.name + " failed: " + str(e))
+            task.timing.record(elapsed_us(start_us, start_ms))
+            next_run = ticks_add(next_run, task.period_ms)
+            delay = ticks_diff(next_run, ticks_ms())
+            if delay < 0:
+                # The task ran past its next slot, skip the missed slots to keep the cadence
+                task.overruns += 1
+                missed = (-delay) // task.period_ms + 1
+                next_run = ticks_add(next_run, missed * task.period_ms)
+                delay = ticks_diff(next_run, ticks_ms())
+            await uasyncio.sleep_ms(delay)
+
+    # Input: Service name and coroutine function that runs until it is cancelled
+    # Output: None
+    # Registers a coroutine that decides itself when to wake up, e.g. to sleep until its next event. The
+    # function is called with its Service and reports how late each event ran with service.record_lateness
+    def add_service(self, name, fun):
+        self.services.append(Service(name, fun))
+
+    async def _run_service(self, service):
+        while self.running:
+            try:
+                await service.fun(service)
+            except Exception as e:
+                service.errors += 1
+                self.logger.error("Service " + service.name + " failed: " + str(e))
+            await uasyncio.sleep(self.SERVICE_RESTART_DELAY)
+
+    async def _report_loop(self, report_period):
+        while self.running:
+            await uasyncio.sleep(report_period)
+            self.log_report()
+
+    # Input: Optional period in seconds at which the task statistics are logged
+    # Output: None
+    # Runs every registered task concurrently until stop() is called
+    async def run(self, report_period=None):
+        self.running = True
+        self.service_tasks = [uasyncio.create_task(self._run_service(service)) for service in self.services]
+        runners = [self._run_task(task) for task in self.tasks]
+        if report_period:
+            runners.append(self._report_loop(report_period))
+        await uasyncio.gather(*runners)
+
+    def stop(self):
+        self.running = False
+        # Services may be sleeping for hours, so they are cancelled instead of waited for
+        for task in self.service_tasks:
+            task.cancel()
+        self.service_tasks = []
+
+    # Input: None
+    # Output: Dictionary of per-task and per-service scheduling statistics
+    def report(self):
+        report = {}
+        for task in self.tasks + self.services:
+            report[task.name] = task.stats()
+        return report
+
+    def log_report(self):
+        for task in self.tasks + self.services:
+            self.logger.log("Task " + task.name + " stats: " + str(task.stats()))
+        self.logger.log("Timings: " + str(Timings.report()))
@@ -0,0 +1,109 @@
+# Host-side hardware simulator for running the board code on CPython
+#
+# The simulator replaces the MicroPython modules the board code imports (machine, network,
+# ntptime, onewire, ds18x20, dht, urequests, usocket, ussl, uasyncio, time/utime) with models
+# driven by a virtual clock, so the full control loop runs faster than real time.
+#
+#   from sim import Simulation
+#   sim = Simulation(board="irrigation")
+#   with sim:
+#       system = sim.run_system(duration=3600)
+#       print(system.scheduler.report())
+import ast
+import importlib
+import json
+import os
+import sys
+import tempfile
+
+from sim.clock import VirtualClock
+from sim.hardware import SimBoard
+from sim.modules import install_modules, make_modules, restore_modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_FILE = os.path.join(ROOT, "config.json")
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from configschema import find_board, profile_name  # noqa: E402
+
+
+class Simulation:
+
+    def __init__(self, board=None, config_file=CONFIG_FILE, cpu_scale=1.0, seed=0,
+            start=(2021, 2, 11, 10, 0, 0), workdir=None, pressure_script=None):
+        self.config_file = os.path.abspath(config_file)
+        with open(self.config_file) as f:
+            self.configs = json.load(f)
+        self.board_key, self.board_configs = find_board(self.configs, board)
+        self.profile = profile_name(self.board_configs)
+        self.clock = VirtualClock(start, cpu_scale)
+        # config.json keys are str(machine.unique_id()), so the key is the repr of the id bytes
+        self.board = SimBoard(self.clock, ast.literal_eval(self.board_key), seed)
+        self.board.wire_from_config(self.board_configs, pressure_script)
+        self.modules = make_modules(self.board)
+        self.workdir = workdir
+        self.saved_modules = None
+        self.saved_cwd = None
+
+    def _purge_board_modules(self):
+        # Board modules bind the simulated modules at import time, so drop any cached copies
+        for name, module in list(sys.modules.items()):
+            path = getattr(module, "__file__", None) or ""
+            if os.path.dirname(os.path.abspath(path)) == ROOT:
+                del sys.modules[name]
+
+    def install(self):
+        if ROOT not in sys.path:
+            sys.path.insert(0, ROOT)
+        self._purge_board_modules()
+        self.saved_modules = install_modules(self.modules)
+        # Logs, queues and other files the board writes go to a scratch directory
+        if self.workdir is None:
+            self.workdir = tempfile.mkdtemp(prefix="esp-sim-")
+        os.makedirs(self.workdir, exist_ok=True)
+        self.saved_cwd = os.getcwd()
+        os.chdir(self.workdir)
+
+    def uninstall(self):
+        if self.saved_modules is not None:
+            self._purge_board_modules()
+            restore_modules(self.saved_modules)
+            self.saved_modules = None
+        if self.saved_cwd is not None:
+            os.chdir(self.saved_cwd)
+            self.saved_cwd = None
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *exc):
+        self.uninstall()
+
+    def import_module(self, name):
+        return importlib.import_module(name)
+
+    def make_system(self):
+        return self.import_module("system").System(self.config_file)
+
+    # Input: Simulated seconds to run the scheduler for and an optional System to run
+    # Output: The System instance after the run
+    # Boots a System for the board and runs its scheduler until duration has passed
+    def run_system(self, duration, system=None, report_period=None):
+        uasyncio = self.modules["uasyncio"]
+        if system is None:
+            system = self.make_system()
+            system.start()
+            system.configure_scheduler()
+
+        async def stopper():
+            await uasyncio.sleep(duration)
+            system.scheduler.stop()
+
+        async def main():
+            await uasyncio.gather(system.scheduler.run(report_period), stopper())
+
+        uasyncio.run(main())
+        system.logger.flush()
+        return system
@@ -0,0 +1,43 @@
+# Runs a board's control loop on simulated hardware
+#
+# Usage: python3 -m sim [--board irrigation|nutrient|<unique_id>] [--duration 3600] [--cpu-scale 1.0]
+import argparse
+import json
+import time
+
+from sim import Simulation
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a board's control loop on simulated hardware")
+    parser.add_argument("--board", default="irrigation", help="irrigation, nutrient or a unique_id key of config.json")
+    parser.add_argument("--config", default=None, help="config.json to load, defaults to the repository copy")
+    parser.add_argument("--duration", type=float, default=3600, help="simulated seconds to run")
+    parser.add_argument("--cpu-scale", type=float, default=1.0, help="how many times slower the chip is than this host")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="directory for the files the board writes")
+    parser.add_argument("--offline", action="store_true", help="start with the Wi-Fi link down")
+    args = parser.parse_args()
+
+    kwargs = {"board": args.board, "cpu_scale": args.cpu_scale, "seed": args.seed, "workdir": args.workdir}
+    if args.config:
+        kwargs["config_file"] = args.config
+    sim = Simulation(**kwargs)
+    sim.board.link_up = not args.offline
+    real_start = time.perf_counter()
+    with sim:
+        system = sim.run_system(args.duration)
+        report = system.scheduler.report()
+    real = time.perf_counter() - real_start
+    print(json.dumps({
+        "board": sim.profile,
+        "simulated_s": round(sim.clock.monotonic(), 3),
+        "real_s": round(real, 3),
+        "speedup": round(sim.clock.monotonic() / real, 1) if real else None,
+        "workdir": sim.workdir,
+        "tasks": report,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
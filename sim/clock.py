@@ -0,0 +1,50 @@
+# Virtual clock shared by every simulated module
+#
+# Simulated time is the time spent sleeping (advanced instantly) plus the host CPU time spent
+# running board code, scaled by cpu_scale to model a slower chip. Sleeping never blocks the host,
+# so the control loop runs faster than real time.
+import calendar
+import time as _time
+
+# MicroPython on the ESP32 counts seconds from 2000-01-01
+EPOCH_2000 = 946684800
+
+
+class VirtualClock:
+
+    def __init__(self, start=(2021, 2, 11, 10, 0, 0), cpu_scale=1.0):
+        self.cpu_scale = cpu_scale
+        self.start_epoch = calendar.timegm(tuple(start) + (0, 0, 0))
+        self.offset_us = 0
+        self.real_start = _time.perf_counter()
+        self.slept_us = 0
+        self.listeners = []
+
+    def now_us(self):
+        cpu_us = (_time.perf_counter() - self.real_start) * 1e6 * self.cpu_scale
+        return int(self.offset_us + cpu_us)
+
+    def advance_us(self, us):
+        if us <= 0:
+            return
+        self.offset_us += us
+        self.slept_us += us
+        for listener in self.listeners:
+            listener(self.now_us())
+
+    def advance(self, seconds):
+        self.advance_us(int(seconds * 1e6))
+
+    def monotonic(self):
+        return self.now_us() / 1e6
+
+    # Input: None
+    # Output: Simulated Unix time in seconds
+    def epoch(self):
+        return self.start_epoch + self.now_us() / 1e6
+
+    def set_epoch(self, epoch):
+        self.start_epoch += epoch - self.epoch()
+
+    def on_advance(self, listener):
+        self.listeners.append(listener)
@@ -0,0 +1,317 @@
+# Models of the hardware attached to the boards, driven by the virtual clock
+import math
+import random
+
+# Latencies of blocking bus operations on the real chip, in microseconds
+ADC_READ_US = 10
+ONEWIRE_SCAN_US = 15000
+ONEWIRE_CONVERT_CMD_US = 2000
+ONEWIRE_READ_US = 12000
+DS18B20_CONVERSION_US = 750000
+I2C_BYTE_US = 90
+SPEED_OF_SOUND_US_PER_CM = 29.1
+
+ETIMEDOUT = 110
+
+
+class PressureModel:
+
+    # Input: Board, pin number of the pump relay and pin numbers of the solenoids
+    def __init__(self, board, pump_pin, solenoid_pins, pressure=90.0, script=None):
+        self.board = board
+        self.pump_pin = pump_pin
+        self.solenoid_pins = solenoid_pins
+        self.pressure = pressure
+        # psi per second while the pump runs, while all solenoids are open and through leaks
+        self.rise_rate = 2.0
+        self.drain_rate = 1.5
+        self.leak_rate = 0.002
+        self.max_pressure = 120.0
+        self.noise = 4.0
+        # Optional callable of simulated seconds returning the pressure, overriding the model
+        self.script = script
+        self.last_update = board.clock.now_us()
+        board.clock.on_advance(self.update)
+        board.on_pin_change(pump_pin, lambda value: self.update(board.clock.now_us()))
+        for pin in solenoid_pins:
+            board.on_pin_change(pin, lambda value: self.update(board.clock.now_us()))
+
+    def pump_on(self):
+        # The pump relay is active low, turn_on_pump() drives the pin off
+        return self.board.get_pin(self.pump_pin) == 0
+
+    def update(self, now_us):
+        dt = (now_us - self.last_update) / 1e6
+        self.last_update = now_us
+        if dt <= 0:
+            return
+        if self.script is not None:
+            self.pressure = self.script(now_us / 1e6)
+            return
+        open_count = sum(1 for pin in self.solenoid_pins if self.board.get_pin(pin))
+        rate = -self.leak_rate - self.drain_rate * open_count / max(1, len(self.solenoid_pins))
+        if self.pump_on():
+            rate += self.rise_rate
+        self.pressure = min(self.max_pressure, max(0.0, self.pressure + rate * dt))
+
+    # Output: Raw 12 bit ADC reading of the transducer
+    def read_raw(self):
+        self.board.clock.advance_us(ADC_READ_US)
+        voltage = (self.pressure + 10.5) / 49.4
+        raw = voltage / 3.3 * 4095 + self.board.random.gauss(0, self.noise)
+        return max(0, min(4095, int(raw)))
+
+
+class ReservoirModel:
+
+    # Input: Board and a dictionary of pin name to pin number from the board config
+    def __init__(self, board, pins, height_cm=28.0):
+        self.board = board
+        self.pins = pins
+        self.height_cm = height_cm
+        self.level_cm = 0.7 * height_cm
+        self.volume_per_cm = 0.25
+        self.temperature = 21.0
+        # True values in the tank and the values seen at the probes, which lag while the tank mixes
+        self.ph = 6.2
+        self.ec = 1200.0
+        self.probe_ph = self.ph
+        self.probe_ec = self.ec
+        self.mix_tau = 60.0
+        self.use_rate_cm = 0.0005
+        self.fill_rate_cm = 0.0017
+        self.ph_drift = 0.00002
+        self.dose_ph_rate = 0.004
+        self.dose_ec_rate = 4.0
+        self.last_update = board.clock.now_us()
+        board.clock.on_advance(self.update)
+        for name in pins:
+            if name.startswith("p_pump") or name == "circulation_pump":
+                board.on_pin_change(pins[name], lambda value: self.update(board.clock.now_us()))
+
+    def pin_on(self, name):
+        return name in self.pins and self.board.get_pin(self.pins[name]) == 1
+
+    def update(self, now_us):
+        dt = (now_us - self.last_update) / 1e6
+        self.last_update = now_us
+        if dt <= 0:
+            return
+        liters = max(0.1, self.level_cm * self.volume_per_cm)
+        self.level_cm = max(0.0, self.level_cm - self.use_rate_cm * dt)
+        if self.pin_on("p_pump6"):
+            added = min(self.height_cm - self.level_cm, self.fill_rate_cm * dt)
+            self.level_cm += added
+            self.ec *= liters / (liters + added * self.volume_per_cm)
+        for num in (1, 2, 3):
+            if self.pin_on("p_pump" + str(num)):
+                self.ec += self.dose_ec_rate * dt / liters
+        if self.pin_on("p_pump4"):
+            self.ph -= self.dose_ph_rate * dt / liters
+        if self.pin_on("p_pump5"):
+            self.ph += self.dose_ph_rate * dt / liters
+        self.ph += self.ph_drift * dt
+        # The circulation pump mixes the tank faster
+        tau = self.mix_tau / 4 if self.board.get_pin(self.pins.get("circulation_pump", -1)) == 0 else self.mix_tau
+        mix = 1 - math.exp(-dt / tau)
+        self.probe_ph += (self.ph - self.probe_ph) * mix
+        self.probe_ec += (self.ec - self.probe_ec) * mix
+
+    def distance_cm(self):
+        return self.height_cm - self.level_cm
+
+
+class VirtualDS18B20:
+
+    def __init__(self, rom, temperature):
+        self.rom = rom
+        # Callable of simulated seconds returning the temperature
+        self.temperature = temperature
+        self.scratchpad = 85.0
+
+    def convert(self, now_s):
+        # 12 bit resolution, 1/16 C steps
+        self.scratchpad = round(self.temperature(now_s) * 16) / 16
+
+
+class OneWireBus:
+
+    def __init__(self, board, sensors):
+        self.board = board
+        self.sensors = sensors
+        self.converting_until = None
+        self.scans = 0
+        self.conversions = 0
+
+    def scan(self):
+        self.board.clock.advance_us(ONEWIRE_SCAN_US * max(1, len(self.sensors)))
+        self.scans += 1
+        return [bytearray(sensor.rom) for sensor in self.sensors]
+
+    def convert_temp(self):
+        self.board.clock.advance_us(ONEWIRE_CONVERT_CMD_US)
+        self.conversions += 1
+        self.converting_until = self.board.clock.now_us() + DS18B20_CONVERSION_US
+
+    def read_temp(self, rom):
+        self.board.clock.advance_us(ONEWIRE_READ_US)
+        now = self.board.clock.now_us()
+        if self.converting_until is not None and now >= self.converting_until:
+            for sensor in self.sensors:
+                sensor.convert(now / 1e6)
+            self.converting_until = None
+        for sensor in self.sensors:
+            if bytes(sensor.rom) == bytes(rom):
+                # Reading while a conversion is still running returns the previous scratchpad
+                return sensor.scratchpad
+        raise Exception("CRC error")
+
+
+class EZODevice:
+
+    READ_MS = {"ph": 900, "ec": 600}
+    STATUS_MS = 300
+
+    # Input: Board, "ph" or "ec" and a callable returning the measured value
+    def __init__(self, board, kind, value):
+        self.board = board
+        self.kind = kind
+        self.value = value
+        self.ready_at = None
+        self.response = None
+        self.commands = []
+
+    def write(self, data):
+        self.board.clock.advance_us(I2C_BYTE_US * (len(data) + 1))
+        command = bytes(data).decode() if not isinstance(data, str) else data
+        self.commands.append(command)
+        now = self.board.clock.now_us()
+        upper = command.upper()
+        if upper == "R" or upper.startswith("RT,"):
+            self.ready_at = now + self.READ_MS[self.kind] * 1000
+            self.response = None
+        elif upper == "STATUS":
+            self.ready_at = now + self.STATUS_MS * 1000
+            self.response = "?STATUS,P,5.038"
+        else:
+            self.ready_at = now + self.STATUS_MS * 1000
+            self.response = ""
+
+    def reply(self, size):
+        self.board.clock.advance_us(I2C_BYTE_US * (size + 1))
+        out = bytearray(size)
+        if self.ready_at is None:
+            out[0] = 255
+            return out
+        if self.board.clock.now_us() < self.ready_at:
+            out[0] = 254
+            return out
+        if self.response is None:
+            value = self.value()
+            if self.kind == "ec":
+                self.response = "{:.2f},{:d}".format(value, int(value * 0.5))
+            else:
+                self.response = "{:.3f}".format(value)
+        text = self.response.encode()[:size - 2]
+        out[0] = 1
+        out[1:1 + len(text)] = text
+        return out
+
+
+class HCSR04Model:
+
+    def __init__(self, board, distance_cm, out_of_range_rate=0.0):
+        self.board = board
+        # Callable returning the distance to the water surface
+        self.distance_cm = distance_cm
+        self.out_of_range_rate = out_of_range_rate
+        self.noise_cm = 0.3
+        self.pings = 0
+
+    def pulse_us(self, timeout_us):
+        self.pings += 1
+        if self.board.random.random() < self.out_of_range_rate:
+            self.board.clock.advance_us(timeout_us)
+            raise OSError(ETIMEDOUT)
+        distance = self.distance_cm() + self.board.random.gauss(0, self.noise_cm)
+        pulse = int(max(2.0, distance) * 2 * SPEED_OF_SOUND_US_PER_CM)
+        if pulse > timeout_us:
+            self.board.clock.advance_us(timeout_us)
+            raise OSError(ETIMEDOUT)
+        self.board.clock.advance_us(pulse)
+        return pulse
+
+
+class SimBoard:
+
+    def __init__(self, clock, unique_id=b"sim-board", seed=0):
+        self.clock = clock
+        self.unique_id = unique_id
+        self.random = random.Random(seed)
+        self.pins = {}
+        self.pin_listeners = {}
+        self.pin_writes = {}
+        self.adc_channels = {}
+        self.onewire_buses = {}
+        self.i2c_devices = {}
+        self.echo_sensors = {}
+        self.dht_values = {}
+        self.link_up = True
+        self.allow_internet = False
+        self.requests = []
+        self.pressure = None
+        self.reservoir = None
+
+    def on_pin_change(self, number, listener):
+        self.pin_listeners.setdefault(number, []).append(listener)
+
+    def get_pin(self, number):
+        return self.pins.get(number, 0)
+
+    def set_pin(self, number, value):
+        value = 1 if value else 0
+        self.pin_writes[number] = self.pin_writes.get(number, 0) + 1
+        if self.pins.get(number, 0) == value and number in self.pins:
+            return
+        self.pins[number] = value
+        for listener in self.pin_listeners.get(number, []):
+            listener(value)
+
+    # Input: Board section of config.json
+    # Output: None
+    # Attaches the sensor and actuator models named in the board's pin and i2c sections
+    def wire_from_config(self, configs, pressure_script=None):
+        pins = configs["pin"]
+        if "pressure_sensor" in pins:
+            solenoids = [pins[name] for name in pins if name.startswith("solenoid_")]
+            self.pressure = PressureModel(self, pins.get("main_pump", -1), solenoids, script=pressure_script)
+            self.adc_channels[pins["pressure_sensor"]] = self.pressure.read_raw
+        self.reservoir = ReservoirModel(self, pins, configs.get("reservoir_height", 28.0))
+        rom_id = 1
+        for name in pins:
+            if not name.startswith("DS18B20"):
+                continue
+            sensors = []
+            count = 1 if "reservoir" in name else 2
+            base = self.reservoir_temperature if "reservoir" in name else self.air_temperature(name)
+            for _ in range(count):
+                rom = bytes([0x28, rom_id, 0, 0, 0, 0, 0, rom_id ^ 0x28])
+                offset = self.random.uniform(-0.3, 0.3)
+                sensors.append(VirtualDS18B20(rom, lambda t, base=base, offset=offset: base(t) + offset))
+                rom_id += 1
+            self.onewire_buses[pins[name]] = OneWireBus(self, sensors)
+        i2c = configs.get("i2c", {})
+        if "ph" in i2c:
+            self.i2c_devices[i2c["ph"]] = EZODevice(self, "ph", lambda: self.reservoir.probe_ph)
+        if "ec" in i2c:
+            self.i2c_devices[i2c["ec"]] = EZODevice(self, "ec", lambda: self.reservoir.probe_ec)
+        if "ultrasonic_echo" in pins:
+            self.echo_sensors[pins["ultrasonic_echo"]] = HCSR04Model(self, self.reservoir.distance_cm)
+
+    def reservoir_temperature(self, t):
+        return self.reservoir.temperature
+
+    # Daily temperature cycle, plant level air runs warmer than the roots
+    def air_temperature(self, name):
+        base = 24.0 if "plant" in name else 21.0
+        return lambda t: base + 4.0 * math.sin(2 * math.pi * (t - 6 * 3600) / 86400)
@@ -0,0 +1,526 @@
+# Stand-ins for the MicroPython modules the board code imports, backed by a SimBoard
+import asyncio
+import calendar
+import json
+import selectors
+import socket
+import ssl
+import struct
+import sys
+import time as _time
+import types
+
+from sim.clock import EPOCH_2000
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    return module
+
+
+# time / utime
+
+def make_time(clock):
+    module = _module("time")
+    # Keep the host time module's attributes so host libraries importing time keep working
+    module.__dict__.update({key: getattr(_time, key) for key in dir(_time) if not key.startswith("__")})
+
+    def ticks_ms():
+        return clock.now_us() // 1000 & 0x3FFFFFFF
+
+    def ticks_us():
+        return clock.now_us() & 0x3FFFFFFF
+
+    def ticks_add(ticks, delta):
+        return (ticks + delta) & 0x3FFFFFFF
+
+    def ticks_diff(end, start):
+        diff = (end - start) & 0x3FFFFFFF
+        return diff - 0x40000000 if diff >= 0x20000000 else diff
+
+    def mp_time():
+        return int(clock.epoch()) - EPOCH_2000
+
+    # MicroPython tuples are (year, month, mday, hour, minute, second, weekday, yearday)
+    def gmtime(secs=None):
+        if secs is None:
+            secs = mp_time()
+        t = _time.gmtime(secs + EPOCH_2000)
+        return (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec, t.tm_wday, t.tm_yday)
+
+    def mktime(t):
+        return calendar.timegm((t[0], t[1], t[2], t[3], t[4], t[5], 0, 0, 0)) - EPOCH_2000
+
+    module.__dict__.update(
+        sleep=lambda s: clock.advance(s),
+        sleep_ms=lambda ms: clock.advance_us(int(ms * 1000)),
+        sleep_us=lambda us: clock.advance_us(int(us)),
+        ticks_ms=ticks_ms,
+        ticks_us=ticks_us,
+        ticks_cpu=ticks_us,
+        ticks_add=ticks_add,
+        ticks_diff=ticks_diff,
+        time=mp_time,
+        time_ns=lambda: int(clock.epoch() * 1e9),
+        gmtime=gmtime,
+        localtime=gmtime,
+        mktime=mktime,
+    )
+    return module
+
+
+# uasyncio
+
+class _VirtualSelector(selectors.DefaultSelector):
+
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+
+    def select(self, timeout=None):
+        ready = super().select(0)
+        if ready:
+            return ready
+        if timeout is None:
+            raise RuntimeError("Simulated event loop has nothing scheduled, every task is blocked")
+        # Nothing to do until the next timer, jump the clock instead of waiting
+        self.clock.advance(timeout)
+        return []
+
+
+class VirtualEventLoop(asyncio.SelectorEventLoop):
+
+    def __init__(self, clock):
+        super().__init__(_VirtualSelector(clock))
+        self.clock = clock
+
+    def time(self):
+        return self.clock.monotonic()
+
+
+def make_uasyncio(clock):
+    def run(coro):
+        loop = VirtualEventLoop(clock)
+        try:
+            asyncio.set_event_loop(loop)
+            return loop.run_until_complete(coro)
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    return _module(
+        "uasyncio",
+        run=run,
+        sleep=asyncio.sleep,
+        sleep_ms=lambda ms: asyncio.sleep(ms / 1000),
+        gather=asyncio.gather,
+        create_task=asyncio.create_task,
+        wait_for=asyncio.wait_for,
+        wait_for_ms=lambda aw, ms: asyncio.wait_for(aw, ms / 1000),
+        Lock=asyncio.Lock,
+        Event=asyncio.Event,
+        CancelledError=asyncio.CancelledError,
+        TimeoutError=asyncio.TimeoutError,
+        get_event_loop=asyncio.get_event_loop,
+        current_task=asyncio.current_task,
+    )
+
+
+# machine
+
+def make_machine(board):
+    clock = board.clock
+
+    class Pin:
+        IN = 1
+        OUT = 3
+        OPEN_DRAIN = 7
+        PULL_UP = 1
+        PULL_DOWN = 2
+        IRQ_RISING = 1
+        IRQ_FALLING = 2
+
+        def __init__(self, id, mode=-1, pull=-1, value=None):
+            self.id = id
+            self.mode = mode
+            if value is not None:
+                board.set_pin(id, value)
+
+        def init(self, mode=-1, pull=-1, value=None):
+            self.mode = mode
+            if value is not None:
+                board.set_pin(self.id, value)
+
+        def value(self, x=None):
+            if x is None:
+                return board.get_pin(self.id)
+            board.set_pin(self.id, x)
+
+        __call__ = value
+
+        def on(self):
+            board.set_pin(self.id, 1)
+
+        def off(self):
+            board.set_pin(self.id, 0)
+
+        def __repr__(self):
+            return "Pin(" + str(self.id) + ")"
+
+    def _pin_id(pin):
+        return pin.id if isinstance(pin, Pin) else pin
+
+    class ADC:
+        ATTN_0DB = 0
+        ATTN_2_5DB = 1
+        ATTN_6DB = 2
+        ATTN_11DB = 3
+        WIDTH_9BIT = 0
+        WIDTH_10BIT = 1
+        WIDTH_11BIT = 2
+        WIDTH_12BIT = 3
+
+        def __init__(self, pin):
+            self.pin = _pin_id(pin)
+            board.adc_channels.setdefault(self.pin, lambda: 0)
+
+        def atten(self, attenuation):
+            pass
+
+        def width(self, width):
+            pass
+
+        def read(self):
+            return board.adc_channels[self.pin]()
+
+        def read_u16(self):
+            return self.read() << 4
+
+    class PWM:
+
+        def __init__(self, pin, freq=5000, duty=0):
+            self.pin = _pin_id(pin)
+            self._freq = freq
+            self._duty = duty
+            board.set_pin(self.pin, duty > 0)
+
+        def duty(self, duty=None):
+            if duty is None:
+                return self._duty
+            self._duty = duty
+            board.set_pin(self.pin, duty > 0)
+
+        def freq(self, freq=None):
+            if freq is None:
+                return self._freq
+            self._freq = freq
+
+        def deinit(self):
+            self.duty(0)
+
+    class I2C:
+
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def scan(self):
+            return sorted(board.i2c_devices)
+
+        def _device(self, addr):
+            if addr not in board.i2c_devices:
+                raise OSError(19)
+            return board.i2c_devices[addr]
+
+        def writeto(self, addr, buf, stop=True):
+            self._device(addr).write(buf)
+            return len(buf)
+
+        def readfrom(self, addr, nbytes, stop=True):
+            return bytes(self._device(addr).reply(nbytes))
+
+        def readfrom_into(self, addr, buf, stop=True):
+            buf[:] = self._device(addr).reply(len(buf))
+
+    class RTC:
+
+        # RTC tuples are (year, month, day, weekday, hours, minutes, seconds, subseconds)
+        def datetime(self, value=None):
+            if value is not None:
+                clock.set_epoch(calendar.timegm((value[0], value[1], value[2], value[4], value[5], value[6], 0, 0, 0)))
+                return
+            epoch = clock.epoch()
+            t = _time.gmtime(int(epoch))
+            return (t.tm_year, t.tm_mon, t.tm_mday, t.tm_wday, t.tm_hour, t.tm_min, t.tm_sec,
+                int((epoch % 1) * 1e6))
+
+        def init(self, value):
+            self.datetime(value)
+
+    def reset():
+        raise SystemExit("machine.reset()")
+
+    def time_pulse_us(pin, pulse_level, timeout_us=1000000):
+        pin_id = _pin_id(pin)
+        if pin_id not in board.echo_sensors:
+            clock.advance_us(timeout_us)
+            raise OSError(110)
+        return board.echo_sensors[pin_id].pulse_us(timeout_us)
+
+    return _module(
+        "machine",
+        Pin=Pin,
+        ADC=ADC,
+        PWM=PWM,
+        I2C=I2C,
+        SoftI2C=I2C,
+        RTC=RTC,
+        time_pulse_us=time_pulse_us,
+        unique_id=lambda: board.unique_id,
+        freq=lambda f=None: 240000000,
+        reset=reset,
+        idle=lambda: None,
+    )
+
+
+# onewire / ds18x20 / dht
+
+def make_onewire(board):
+    class OneWireError(Exception):
+        pass
+
+    class OneWire:
+
+        def __init__(self, pin):
+            self.pin = pin.id
+            self.bus = board.onewire_buses.get(self.pin)
+
+        def _bus(self):
+            if self.bus is None:
+                raise OneWireError("No devices on pin " + str(self.pin))
+            return self.bus
+
+        def reset(self, required=False):
+            return self.bus is not None and len(self.bus.sensors) > 0
+
+        def scan(self):
+            return self._bus().scan() if self.bus is not None else []
+
+    return _module("onewire", OneWire=OneWire, OneWireError=OneWireError)
+
+
+def make_ds18x20():
+    class DS18X20:
+
+        def __init__(self, onewire):
+            self.ow = onewire
+
+        def scan(self):
+            return [rom for rom in self.ow.scan() if rom[0] in (0x10, 0x22, 0x28)]
+
+        def convert_temp(self):
+            self.ow._bus().convert_temp()
+
+        def read_temp(self, rom):
+            return self.ow._bus().read_temp(rom)
+
+    return _module("ds18x20", DS18X20=DS18X20)
+
+
+def make_dht(board):
+    class DHT22:
+
+        def __init__(self, pin):
+            self.pin = pin.id
+            self._temperature = 0
+            self._humidity = 0
+
+        def measure(self):
+            if self.pin not in board.dht_values:
+                raise OSError(110)
+            board.clock.advance_us(5000)
+            self._temperature, self._humidity = board.dht_values[self.pin]
+
+        def temperature(self):
+            return self._temperature
+
+        def humidity(self):
+            return self._humidity
+
+    return _module("dht", DHT22=DHT22, DHT11=DHT22)
+
+
+# network / ntptime
+
+def make_network(board):
+    # Every WLAN(STA_IF) object refers to the same interface on the chip, so the state is shared
+    interfaces = {}
+
+    class WLAN:
+
+        def __init__(self, interface=0):
+            self._state = interfaces.setdefault(interface, {"active": False, "connected": False})
+
+        def active(self, state=None):
+            if state is None:
+                return self._state["active"]
+            self._state["active"] = state
+
+        def connect(self, ssid=None, password=None):
+            self._state["connected"] = True
+
+        def disconnect(self):
+            self._state["connected"] = False
+
+        def isconnected(self):
+            return self._state["connected"] and board.link_up
+
+        def ifconfig(self):
+            return ("192.168.4.2", "255.255.255.0", "192.168.4.1", "8.8.8.8")
+
+    return _module("network", WLAN=WLAN, STA_IF=0, AP_IF=1)
+
+
+def make_ntptime(board):
+    def settime():
+        if not board.link_up:
+            raise OSError(110)
+
+    return _module("ntptime", settime=settime, host="pool.ntp.org")
+
+
+# usocket / ussl / urequests
+
+class _SocketStream:
+    # MicroPython sockets expose write/read/readline directly
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.stream = None
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def connect(self, address):
+        self.sock.connect(address)
+        self.stream = self.sock.makefile("rwb")
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.stream.write(data)
+        self.stream.flush()
+        return len(data)
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def readline(self):
+        return self.stream.readline()
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+        self.sock.close()
+
+
+def make_usocket(board):
+    def getaddrinfo(host, port, af=0, type=0, proto=0, flags=0):
+        if not board.link_up:
+            raise OSError(-202)
+        # Keep simulated boards off the real server unless asked, e.g. point them at tools/upload_server.py
+        if not board.allow_internet and host not in ("localhost", "127.0.0.1"):
+            raise OSError(-202)
+        return socket.getaddrinfo(host, port, af, type, proto, flags)
+
+    return _module(
+        "usocket",
+        getaddrinfo=getaddrinfo,
+        socket=lambda af=socket.AF_INET, type=socket.SOCK_STREAM, proto=0: _SocketStream(socket.socket(af, type, proto)),
+        AF_INET=socket.AF_INET,
+        SOCK_STREAM=socket.SOCK_STREAM,
+        SOCK_DGRAM=socket.SOCK_DGRAM,
+    )
+
+
+def make_ussl():
+    def wrap_socket(sock, server_hostname=None, **kwargs):
+        context = ssl.create_default_context()
+        sock.sock = context.wrap_socket(sock.sock, server_hostname=server_hostname)
+        sock.stream = sock.sock.makefile("rwb")
+        return sock
+
+    return _module("ussl", wrap_socket=wrap_socket)
+
+
+def make_urequests(board):
+    class Response:
+
+        def __init__(self, status_code, body):
+            self.status_code = status_code
+            self.content = json.dumps(body).encode()
+            self.text = self.content.decode()
+
+        def json(self):
+            return json.loads(self.content)
+
+        def close(self):
+            pass
+
+    def request(method, url, data=None, json_body=None, headers=None):
+        if not board.link_up:
+            raise OSError(-202)
+        board.requests.append((method, url, data))
+        return Response(201, {"id": len(board.requests)})
+
+    return _module(
+        "urequests",
+        request=request,
+        put=lambda url, data=None, headers=None, **kw: request("PUT", url, data, None, headers),
+        post=lambda url, data=None, headers=None, **kw: request("POST", url, data, None, headers),
+        get=lambda url, headers=None, **kw: request("GET", url, None, None, headers),
+    )
+
+
+SIMULATED = ("time", "utime", "uasyncio", "machine", "onewire", "ds18x20", "dht", "network",
+    "ntptime", "usocket", "ussl", "urequests", "ujson", "ustruct", "uos")
+
+
+# Input: SimBoard
+# Output: Dictionary of module name to the simulated module
+def make_modules(board):
+    time_module = make_time(board.clock)
+    import os
+    return {
+        "time": time_module,
+        "utime": time_module,
+        "uasyncio": make_uasyncio(board.clock),
+        "machine": make_machine(board),
+        "onewire": make_onewire(board),
+        "ds18x20": make_ds18x20(),
+        "dht": make_dht(board),
+        "network": make_network(board),
+        "ntptime": make_ntptime(board),
+        "usocket": make_usocket(board),
+        "ussl": make_ussl(),
+        "urequests": make_urequests(board),
+        "ujson": json,
+        "ustruct": struct,
+        "uos": os,
+    }
+
+
+def install_modules(modules):
+    saved = {}
+    for name in modules:
+        saved[name] = sys.modules.get(name)
+        sys.modules[name] = modules[name]
+    return saved
+
+
+def restore_modules(saved):
+    for name in saved:
+        if saved[name] is None:
+            sys.modules.pop(name, None)
+        else:
+            sys.modules[name] = saved[name]
@@ -0,0 +1,58 @@
+# This class handles the misting schedule of the solenoids, each opening on its own period
+from uasyncio import sleep
+from logger import Logger
+
+class SolenoidScheduler:
+
+    ESP_LOG_FILE = "esp_log.txt"
+    SOLENOIDS = ("upper_left", "upper_right", "lower_left", "lower_right")
+    # Seconds a solenoid stays open per misting
+    OPEN_TIME = 10
+
+    # Input: Dictionary of the boards pins, the optional "solenoids" section of the board config and the
+    #        default period in seconds
+    # The section sets open_time, period and stagger for every solenoid, and a section per solenoid
+    # (e.g. "upper_left") can override open_time, period and offset for that solenoid
+    def __init__(self, pins, configs=None, period=180):
+        if configs is None:
+            configs = {}
+        self.logger = Logger(self.ESP_LOG_FILE)
+        open_time = configs.get("open_time", self.OPEN_TIME)
+        period = configs.get("period", period)
+        # Seconds between the openings of consecutive solenoids, by default one closes before the next
+        # opens so the pressure drops by a quarter as much and the pump cycles less often
+        stagger = configs.get("stagger", open_time)
+        self.schedule = []
+        offset = 0
+        for name in self.SOLENOIDS:
+            pin_name = "solenoid_" + name
+            if pin_name not in pins:
+                continue
+            own = configs.get(name, {})
+            entry = (name, pins[pin_name], own.get("open_time", open_time), own.get("period", period),
+                own.get("offset", offset))
+            if entry[2] >= entry[3]:
+                raise ValueError("Solenoid " + name + " open_time has to be shorter than its period")
+            self.schedule.append(entry)
+            offset += stagger
+        self.mistings = 0
+
+    def mister(self, name, pin, open_time):
+        async def mist():
+            pin.on()
+            try:
+                await sleep(open_time)
+            finally:
+                pin.off()
+            self.mistings += 1
+            self.logger.log("Solenoid " + name + " misted for " + str(open_time) + " s")
+        return mist
+
+    # Input: None
+    # Output: List of (task name, coroutine function, period in seconds, offset in seconds) with one
+    #         scheduler task per solenoid
+    def tasks(self):
+        tasks = []
+        for name, pin, open_time, period, offset in self.schedule:
+            tasks.append(("solenoid_" + name, self.mister(name, pin, open_time), period, offset))
+        return tasks
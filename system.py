@@ -1,12 +1,16 @@
 # This class handles the coordination of the boards functions
-import ujson
 import network
 import ntptime
 import machine
-from time import sleep, time
+import uasyncio
+from time import sleep
 from datauploader import DataUploader
 from devicehandler import DeviceHandler
 from logger import Logger
+from scheduler import Scheduler
+from configloader import load_configs
+from telemetry import build_schema
+from timing import Timings
 
 class System:
 
@@ -16,14 +20,28 @@ class System:
 
     def __init__(self, config_file="config.json"):
         self.logger = Logger(self.ESP_LOG_FILE)
-        f = open(config_file)
         self.id = str(machine.unique_id())
-        self.configs = ujson.load(f)
+        self.configs = load_configs(config_file)
+        self.configure_logging()
         self.logger.log("Configs loaded")
         self.device_handler = DeviceHandler(self.configs)
-        self.data_uploader = DataUploader()
+        self.data_uploader = DataUploader(self.configs[self.id].get("upload"), build_schema(self.configs[self.id]),
+            self.task_period("data_reader"))
+        self.scheduler = Scheduler()
         self.error_flag = 0
 
+    # Switches the log file to buffered mode unless buffer_size is 0, and enables rotation when max_size is
+    # set, when the board config has a "log" section
+    def configure_logging(self):
+        log_configs = self.configs[self.id].get("log")
+        if not log_configs:
+            return
+        if log_configs.get("buffer_size", 32) > 0:
+            Logger.enable_buffering(self.ESP_LOG_FILE, log_configs.get("buffer_size", 32),
+                log_configs.get("flush_interval", 60), log_configs.get("min_write_interval", 10))
+        if log_configs.get("max_size"):
+            Logger.enable_rotation(self.ESP_LOG_FILE, log_configs["max_size"], log_configs.get("generations", 3))
+
     def connect_wifi(self):
         ssid = self.configs[self.id]["ssid"]
         password = self.configs[self.id]["password"]
@@ -42,7 +60,7 @@ class System:
             connect_attempts += 1
             sleep(1)
         if connect_attempts >= self.MAX_CONNECT_ATTEMPTS:
-            self.logger.log("Failed to connect to wifi")
+            self.logger.error("Failed to connect to wifi")
             self.error_flag = 1
             return
 
@@ -63,82 +81,131 @@ class System:
         self.retry_fun(ntptime.settime)
         self.device_handler.set_initial_state()
 
+    # Input: Name of an esp_type capability
+    # Output: Period in seconds at which the capability's task runs
+    # Falls back to loop_frequency when the board has no task_period entry for the task
+    def task_period(self, name):
+        periods = self.configs[self.id].get("task_period", {})
+        return periods.get(name, self.configs[self.id]["loop_frequency"])
+
+    def configure_scheduler(self):
+        esp_type = self.configs[self.id]["esp_type"]
+        if esp_type["solenoids"]:
+            # One task per solenoid, so the misting never holds up the other tasks
+            for name, fun, period, offset in self.device_handler.solenoid_scheduler.tasks():
+                self.scheduler.add_task(name, fun, period, offset)
+        if esp_type["data_reader"]:
+            self.scheduler.add_task("data_reader", self.read_and_upload, self.task_period("data_reader"))
+        if esp_type["pump"]:
+            self.scheduler.add_task("pump", self.device_handler.check_pump, self.task_period("pump"))
+        if esp_type["lights"]:
+            # Sleeps until the next light transition instead of running every cycle
+            self.scheduler.add_service("lights", self.device_handler.light_scheduler.run)
+        if esp_type["fans"]:
+            self.scheduler.add_task("fans", self.device_handler.check_fans, self.task_period("fans"))
+        if esp_type["water_level"]:
+            self.scheduler.add_task("water_level", self.fill_water, self.task_period("water_level"))
+        if esp_type["nutrient_controller"]:
+            self.scheduler.add_task("nutrient_controller", self.control_nutrients, self.task_period("nutrient_controller"))
+        stats_interval = self.configs[self.id].get("upload", {}).get("stats_interval")
+        if esp_type["data_uploader"] and stats_interval:
+            self.scheduler.add_task("stats", self.upload_timings, stats_interval)
+        log_configs = self.configs[self.id].get("log")
+        if log_configs:
+            self.scheduler.add_task("log_flush", self.logger.flush_if_due, log_configs.get("flush_interval", 60))
+
     def run(self):
         self.start()
-        while self.error_flag == 0:
-            start_time = time()
-            if self.configs[self.id]["esp_type"]["solenoids"]:
-                self.device_handler.open_close_solenoids()
-            if self.configs[self.id]["esp_type"]["data_reader"]:
-                data = self.device_handler.read_all_data()
-            if self.configs[self.id]["esp_type"]["data_uploader"]:
-                self.data_uploader.upload_data(data)
-            if self.configs[self.id]["esp_type"]["pump"]:
-                self.device_handler.check_pump()
-            if self.configs[self.id]["esp_type"]["lights"]:
-                 self.device_handler.check_lights()
-            if self.configs[self.id]["esp_type"]["fans"]:
-                 self.device_handler.check_fans()
-            if self.configs[self.id]["esp_type"]["water_level"]:
-                 self.fill_water()
-            if self.configs[self.id]["esp_type"]["nutrient_controller"]:
-                 self.fill_all_nutrients()
-                 self.fix_ph()
-        # This allows us to always upload at exactly the UPLOAD_FREQUENCY cadence
-            sleep(self.configs[self.id]["loop_frequency"] - (time() - start_time) % self.configs[self.id]["loop_frequency"])
+        if self.error_flag == 0:
+            self.configure_scheduler()
+            uasyncio.run(self.scheduler.run(self.configs[self.id]["loop_frequency"]))
         self.logger.log("Process stopped")
+        self.logger.flush()
+
+    async def read_and_upload(self):
+        data = await self.device_handler.read_all_data()
+        if self.configs[self.id]["esp_type"]["data_uploader"]:
+            self.data_uploader.upload_data(data)
+
+    # Uploads the call timings gathered since the last upload and starts a new interval
+    async def upload_timings(self):
+        stats = {"time_sent": str(machine.RTC().datetime()), "timings": Timings.report()}
+        if self.data_uploader.upload_stats(stats):
+            Timings.reset()
+
+    # Input: None
+    # Output: Dictionary of call timing statistics, also written to the log
+    def dump_timings(self):
+        report = Timings.report()
+        self.logger.log("Timings: " + str(report))
+        return report
+
+    async def control_nutrients(self):
+        if self.device_handler.ec_controller is not None:
+            await self.device_handler.ec_controller.check()
+        else:
+            await self.fill_all_nutrients()
+        await self.fix_ph()
     
-    def fill_water(self):
-        water_level = self.device_handler.read_water_level()
-        if water_level < 0.6 * self.configs[self.id]["reservoir_height"]:
-            self.device_handler.add_water()
+    # Tops up only on a trusted reading taken now, a cached or rejected one never starts the water pump
+    async def fill_water(self):
+        water_level = await self.device_handler.read_water_level(0)
+        if water_level is None:
+            return
+        fill_below = self.configs[self.id].get("water_level", {}).get("fill_below", 0.6)
+        if water_level < fill_below * self.configs[self.id]["reservoir_height"]:
+            await self.device_handler.add_water()
 
     
-    def fill_all_nutrients(self):
-        self.device_handler.circulation_pump_on()
-        for cont in range(1,4):
-            self.device_handler.add_nutrient(cont)
-        sleep(15)
-        self.device_handler.circulation_pump_off()
+    # Doses nutrients 1-3 as one job, stirring together and pumping concurrently
+    async def fill_all_nutrients(self):
+        await self.device_handler.dosing_engine.dose_ml([(1,), (2,), (3,)])
     
-    def fix_ph(self):
-        self.device_handler.circulation_pump_on()
-        while float(self.device_handler.read_ph()) > 8: 
-            self.device_handler.add_nutrient(4)
-        while float(self.device_handler.read_ph()) < 5.5:
-            self.device_handler.add_nutrient(5)
-        sleep(15)
-        self.device_handler.circulation_pump_off()
+    async def fix_ph(self):
+        if self.device_handler.ph_controller is not None:
+            await self.device_handler.ph_controller.check()
     
     def test_loops(self):
         while True:
-            self.device_handler.open_close_solenoids()
-            self.device_handler.check_pump()
+            uasyncio.run(self.device_handler.open_close_solenoids())
+            uasyncio.run(self.device_handler.check_pump())
 
     def test_pump(self):
-        self.device_handler.test_pump()
+        uasyncio.run(self.device_handler.test_pump())
 
     def test_solenoids(self):
-        self.device_handler.test_solenoids()
+        uasyncio.run(self.device_handler.test_solenoids())
 
     def test_ec(self):
-        ec, ppm = self.device_handler.read_ec()
+        ec = uasyncio.run(self.device_handler.read_ec())
+        ppm = self.device_handler.ec_sensor.values[1]
         print("EC: " + str(ec) + " PPM: " + str(ppm))
 
     def test_ph(self):
-        pH = self.device_handler.read_ph()
+        pH = uasyncio.run(self.device_handler.read_ph())
         print("pH: " + str(pH))
 
     def test_water_level(self):
-        water_level = self.device_handler.read_water_level()
-        print("Water level: " + str(water_level))
+        water_level = uasyncio.run(self.device_handler.read_water_level())
+        sensor = self.device_handler.water_level_sensor
+        print("Water level: " + str(water_level) + " confidence: " + str(sensor.confidence))
+
+    # Input: Pump number, seconds to run it and the mL it dispensed in a previous run
+    # Runs the pump into a measuring cup, call again with the measured volume to get its ml_per_s
+    def calibrate_pump(self, num, seconds=30, ml=None):
+        if ml is None:
+            ms = uasyncio.run(self.device_handler.dosing_engine.calibrate(num, seconds))
+            print("p_pump" + str(num) + " ran for " + str(ms) + " ms, measure the volume and call calibrate_pump("
+                + str(num) + ", " + str(seconds) + ", ml)")
+        else:
+            print("\"p_pump" + str(num) + "\": {\"ml_per_s\": " + str(round(ml / seconds, 3)) + "}")
 
     def test_pressure(self):
           pressure = self.device_handler.read_pressure()
           print("Pressure: " + str(pressure))
 
     def test_ds18b20(self, pin_name):
-          temp = self.device_handler.read_ds18b20(pin_name)
+          temp = uasyncio.run(self.device_handler.read_ds18b20(pin_name))
           print(temp)
 
     def turn_off_pump(self):
@@ -225,7 +292,7 @@ class System:
 
 
     def p_pump_on(self):
-        self.device_handler.p_pump_on()
+        uasyncio.run(self.device_handler.p_pump_on())
    
    
    
@@ -267,7 +334,7 @@ class System:
    
     
     def stirrer_on(self, stirrer_num):
-        self.device_handler.stirrer_on(stirrer_num)
+        uasyncio.run(self.device_handler.stirrer_on(stirrer_num))
     
     def stirrer_off(self, stirrer_num):
         self.device_handler.stirrer_off(stirrer_num)
@@ -0,0 +1,172 @@
+# This module handles the compact binary wire format of the readings produced by read_all_data
+#
+# Record layout (little endian):
+#   uint8  MAGIC
+#   uint16 schema id, derived from the field names of the board's schema
+#   uint32 time_sent as seconds since 1970-01-01
+#   uint16 bitmap of the schema fields present in the record
+#   values of the present fields in schema order, scalars as fixed point integers and
+#   temperature lists as a uint8 count followed by int16 values
+# Records are self delimiting, a batch is the records concatenated.
+import struct
+
+MAGIC = 0xE5
+HEADER = "<BHIH"
+HEADER_SIZE = struct.calcsize(HEADER)
+# Marks a field holding a list of int16 values
+LIST = "L"
+LIST_ITEM = "<h"
+# MicroPython's struct.pack wraps values outside the range of a format instead of raising, so they are checked
+RANGES = {"<B": (0, 0xFF), "<h": (-0x8000, 0x7FFF), "<H": (0, 0xFFFF), "<i": (-0x80000000, 0x7FFFFFFF),
+    "<I": (0, 0xFFFFFFFF)}
+
+# Input: Field name, struct format and integer value
+# Output: bytes of the value
+def pack_value(name, fmt, value):
+    low, high = RANGES[fmt]
+    if value < low or value > high:
+        raise ValueError(name + " out of range for " + fmt + ": " + str(value))
+    return struct.pack(fmt, value)
+
+DS18B20_BUSES = ("DS18B20_root_upper", "DS18B20_root_lower", "DS18B20_plant_upper", "DS18B20_plant_lower")
+
+# Input: Board section of config.json
+# Output: List of (field name, struct format or LIST, fixed point scale)
+# Builds the schema of the fields read_all_data produces for the board
+def build_schema(configs):
+    esp_type = configs["esp_type"]
+    schema = []
+    if esp_type["pressure_reader"]:
+        schema.append(("pressure", "<h", 100))
+    if esp_type["pH_reader"]:
+        schema.append(("pH", "<H", 100))
+    if esp_type["ec_reader"]:
+        schema.append(("ec", "<i", 100))
+    if esp_type["temp_reader"]:
+        for bus in DS18B20_BUSES:
+            schema.append(("temperature_" + bus[len("DS18B20_"):], LIST, 100))
+    if esp_type["reservoir_temp_reader"] and "DS18B20_reservoir" in configs["pin"]:
+        schema.append(("temperature_reservoir", LIST, 100))
+    if esp_type["water_level"]:
+        schema.append(("water_level", "<h", 100))
+    if len(schema) > 16:
+        raise ValueError("Telemetry schema has more than 16 fields")
+    return schema
+
+def schema_id(schema):
+    h = 5381
+    for field in schema:
+        for c in field[0]:
+            h = (h * 33 + ord(c)) & 0xFFFF
+    return h
+
+def _days_from_civil(year, month, day):
+    year -= month <= 2
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+# Input: RTC datetime tuple (year, month, day, weekday, hours, minutes, seconds, subseconds) or its str()
+# Output: Seconds since 1970-01-01
+def rtc_to_epoch(rtc_time):
+    if isinstance(rtc_time, str):
+        rtc_time = [int(part) for part in rtc_time.strip("()").split(",")]
+    days = _days_from_civil(rtc_time[0], rtc_time[1], rtc_time[2])
+    return days * 86400 + rtc_time[4] * 3600 + rtc_time[5] * 60 + rtc_time[6]
+
+# Input: Seconds since 1970-01-01
+# Output: RTC datetime tuple with weekday 0 as Monday and subseconds 0
+def epoch_to_rtc(epoch):
+    days, rem = divmod(epoch, 86400)
+    z = days + 719468
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = mp + (3 if mp < 10 else -9)
+    year = yoe + era * 400 + (month <= 2)
+    weekday = (days + 3) % 7
+    return (year, month, day, weekday, rem // 3600, rem // 60 % 60, rem % 60, 0)
+
+class TelemetryEncoder:
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.schema_id = schema_id(schema)
+        self.names = [field[0] for field in schema]
+
+    # Input: Dictionary of readings from read_all_data
+    # Output: bytes of one record, fields that are not in the schema are left out
+    def encode(self, data):
+        bitmap = 0
+        values = []
+        for i in range(len(self.schema)):
+            name, fmt, scale = self.schema[i]
+            value = data.get(name)
+            if value is None:
+                continue
+            bitmap |= 1 << i
+            if fmt == LIST:
+                values.append(pack_value(name, "<B", len(value)))
+                for item in value:
+                    values.append(pack_value(name, LIST_ITEM, round(float(item) * scale)))
+            else:
+                values.append(pack_value(name, fmt, round(float(value) * scale)))
+        epoch = rtc_to_epoch(data["time_sent"])
+        if epoch < 0 or epoch > RANGES["<I"][1]:
+            raise ValueError("time_sent out of range: " + str(data["time_sent"]))
+        header = struct.pack(HEADER, MAGIC, self.schema_id, epoch, bitmap)
+        return header + b"".join(values)
+
+    def encode_batch(self, batch):
+        return b"".join([self.encode(data) for data in batch])
+
+class TelemetryDecoder:
+
+    # Input: List of schemas, usually one per board of config.json
+    def __init__(self, schemas):
+        self.schemas = {}
+        for schema in schemas:
+            self.schemas[schema_id(schema)] = schema
+
+    # Input: bytes holding one record at offset
+    # Output: Tuple of (readings dictionary, offset after the record)
+    def decode_record(self, payload, offset=0):
+        magic, sid, epoch, bitmap = struct.unpack_from(HEADER, payload, offset)
+        if magic != MAGIC:
+            raise ValueError("Bad telemetry magic byte at offset " + str(offset))
+        if sid not in self.schemas:
+            raise ValueError("Unknown telemetry schema id " + str(sid))
+        offset += HEADER_SIZE
+        data = {"time_sent": str(epoch_to_rtc(epoch)), "epoch": epoch}
+        schema = self.schemas[sid]
+        for i in range(len(schema)):
+            if not bitmap & (1 << i):
+                continue
+            name, fmt, scale = schema[i]
+            if fmt == LIST:
+                count = payload[offset]
+                offset += 1
+                items = []
+                for _ in range(count):
+                    items.append(struct.unpack_from(LIST_ITEM, payload, offset)[0] / scale)
+                    offset += 2
+                data[name] = items
+            else:
+                data[name] = struct.unpack_from(fmt, payload, offset)[0] / scale
+                offset += struct.calcsize(fmt)
+        return data, offset
+
+    # Input: bytes of one or more concatenated records
+    # Output: List of readings dictionaries
+    def decode(self, payload):
+        records = []
+        offset = 0
+        while offset < len(payload):
+            data, offset = self.decode_record(payload, offset)
+            records.append(data)
+        return records
@@ -0,0 +1,89 @@
+# This class handles the DS18B20 temperature sensors on every one-wire bus of the board
+import uasyncio
+import ds18x20
+import onewire
+from time import ticks_ms, ticks_diff
+from logger import Logger
+
+class TemperatureSensors:
+
+    ESP_LOG_FILE = "esp_log.txt"
+    # Conversion time of a DS18B20 at 12 bit resolution
+    CONVERSION_MS = 750
+
+    # Input: Dictionary of bus name to machine.Pin
+    def __init__(self, pins):
+        self.logger = Logger(self.ESP_LOG_FILE)
+        # Sensor objects and ROM lists are kept between cycles, a ROM list of None forces a rescan
+        self.sensors = {}
+        self.roms = {}
+        self.last_temps = {}
+        self.last_read = {}
+        for name in pins:
+            self.sensors[name] = ds18x20.DS18X20(onewire.OneWire(pins[name]))
+            self.roms[name] = None
+        # Only one conversion runs at a time so concurrent readers do not interleave on a bus
+        self.lock = uasyncio.Lock()
+
+    def scan(self, name):
+        try:
+            self.roms[name] = self.sensors[name].scan()
+        except OSError:
+            self.logger.log("Failed to scan DS18B20 bus " + name)
+            self.roms[name] = None
+
+    def start_conversion(self, names):
+        started = []
+        for name in names:
+            if not self.roms[name]:
+                self.scan(name)
+            if not self.roms[name]:
+                continue
+            try:
+                self.sensors[name].convert_temp()
+                started.append(name)
+            except OSError:
+                self.logger.log("Failed to start DS18B20 conversion on " + name)
+                self.roms[name] = None
+        return started
+
+    def read_bus(self, name):
+        temps = []
+        for rom in self.roms[name]:
+            try:
+                temps.append(self.sensors[name].read_temp(rom))
+            except Exception:
+                # A CRC error or a missing sensor, rescan the bus on the next cycle
+                self.logger.log("Failed to read DS18B20 sensor on " + name)
+                self.roms[name] = None
+        return temps
+
+    def _is_fresh(self, name, max_age_ms):
+        if name not in self.last_read:
+            return False
+        return ticks_diff(ticks_ms(), self.last_read[name]) <= max_age_ms
+
+    # Input: List of bus names (defaults to every bus) and the maximum age in ms of a cached reading
+    # Output: Dictionary of bus name to list of temperatures, empty for a bus that could not be read
+    # Starts a conversion on every bus at once and waits for them together
+    async def read(self, names=None, max_age_ms=0):
+        if names is None:
+            names = list(self.sensors)
+        async with self.lock:
+            stale = [name for name in names if not self._is_fresh(name, max_age_ms)]
+            if stale:
+                started = self.start_conversion(stale)
+                if started:
+                    await uasyncio.sleep_ms(self.CONVERSION_MS)
+                now = ticks_ms()
+                for name in stale:
+                    self.last_temps[name] = self.read_bus(name) if name in started else []
+                    # A failed bus is not cached, so the next read tries it again instead of reusing nothing
+                    if self.last_temps[name]:
+                        self.last_read[name] = now
+                    elif name in self.last_read:
+                        del self.last_read[name]
+        temps = {}
+        for name in names:
+            temps[name] = self.last_temps[name]
+        return temps
@@ -0,0 +1,129 @@
+# This class handles the timing statistics of the boards sensor reads, actuator actions and uploads
+import array
+from time import ticks_us, ticks_ms, ticks_diff
+
+# Upper bounds of the histogram buckets in microseconds, the last bucket counts everything slower
+BUCKETS_US = (1000, 5000, 10000, 50000, 100000, 500000, 1000000, 5000000, 10000000, 60000000)
+# ticks_us wraps after 2**29 us (about 537 s), calls taking longer than this are measured with ticks_ms
+US_RANGE_MS = 500000
+
+# Input: ticks_us and ticks_ms taken at the start of a call
+# Output: Microseconds since the start, in ms resolution for calls too long for ticks_us
+def elapsed_us(start_us, start_ms):
+    elapsed_ms = ticks_diff(ticks_ms(), start_ms)
+    if elapsed_ms >= US_RANGE_MS:
+        return elapsed_ms * 1000
+    return ticks_diff(ticks_us(), start_us)
+
+class TimingStat:
+
+    def __init__(self, name):
+        self.name = name
+        # Allocated once, recording a call counts in place
+        self.buckets = array.array("L", [0] * (len(BUCKETS_US) + 1))
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+        self.last_us = 0
+        for i in range(len(self.buckets)):
+            self.buckets[i] = 0
+
+    # Input: Duration of one call in microseconds
+    # Output: None
+    def record(self, elapsed_us):
+        self.count += 1
+        self.total_us += elapsed_us
+        self.last_us = elapsed_us
+        if elapsed_us > self.max_us:
+            self.max_us = elapsed_us
+        i = 0
+        while i < len(BUCKETS_US) and elapsed_us > BUCKETS_US[i]:
+            i += 1
+        self.buckets[i] += 1
+
+    # Input: Percentile between 0 and 100
+    # Output: Upper bound in ms of the bucket holding the percentile, the maximum for the last bucket
+    def percentile_ms(self, p):
+        if self.count == 0:
+            return 0
+        target = (self.count * p + 99) // 100
+        seen = 0
+        for i in range(len(BUCKETS_US)):
+            seen += self.buckets[i]
+            if seen >= target:
+                return min(BUCKETS_US[i], self.max_us) // 1000
+        return self.max_us // 1000
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "avg_ms": self.total_us // self.count // 1000 if self.count else 0,
+            "max_ms": self.max_us // 1000,
+            "p50_ms": self.percentile_ms(50),
+            "p95_ms": self.percentile_ms(95),
+            "hist": list(self.buckets)
+        }
+
+class Timings:
+
+    # Shared by every module so one report covers the whole board
+    stats = {}
+
+    # Input: Name of the timed call
+    # Output: The TimingStat of the call, created on first use
+    @classmethod
+    def get(cls, name):
+        stat = cls.stats.get(name)
+        if stat is None:
+            stat = TimingStat(name)
+            cls.stats[name] = stat
+        return stat
+
+    # Input: None
+    # Output: Dictionary of timing statistics of every call made at least once
+    @classmethod
+    def report(cls):
+        report = {}
+        for name in cls.stats:
+            stat = cls.stats[name]
+            if stat.count:
+                report[name] = stat.stats()
+        return report
+
+    @classmethod
+    def reset(cls):
+        for name in cls.stats:
+            cls.stats[name].reset()
+
+# Input: Name under which the calls are recorded
+# Output: Decorator timing every call of a function
+def timed(name):
+    stat = Timings.get(name)
+    def decorator(fun):
+        def wrapper(*args, **kwargs):
+            start_us = ticks_us()
+            start_ms = ticks_ms()
+            try:
+                return fun(*args, **kwargs)
+            finally:
+                stat.record(elapsed_us(start_us, start_ms))
+        return wrapper
+    return decorator
+
+# Input: Name under which the calls are recorded
+# Output: Decorator timing every call of a coroutine function, including the time spent awaiting
+def timed_async(name):
+    stat = Timings.get(name)
+    def decorator(fun):
+        async def wrapper(*args, **kwargs):
+            start_us = ticks_us()
+            start_ms = ticks_ms()
+            try:
+                return await fun(*args, **kwargs)
+            finally:
+                stat.record(elapsed_us(start_us, start_ms))
+        return wrapper
+    return decorator
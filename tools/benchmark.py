@@ -0,0 +1,243 @@
+# Benchmarks the control loop of each board profile on simulated hardware
+#
+# Usage: python3 tools/benchmark.py [--board irrigation] [--cycles 5] [--out results.json]
+#                                   [--compare baseline.json --threshold 10] [--local-server]
+#
+# Each cycle runs every phase the board's esp_type enables once, in the order of the original
+# System.run loop, and records the simulated time spent in each phase. A second run drives the
+# scheduler for --duration simulated seconds and records its per-task lateness. Results are saved
+# as JSON; --compare exits with status 1 when a phase got slower than the baseline by more than
+# --threshold percent.
+import argparse
+import contextlib
+import inspect
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+from configschema import board_sections, find_board, profile_name  # noqa: E402
+from sim import Simulation  # noqa: E402
+
+
+# Input: System under test
+# Output: List of (phase name, esp_type flag, callable)
+# The callable returns a value, or a coroutine that is run to completion
+def phases(system):
+    device = system.device_handler
+    state = {}
+
+    def read_all_data():
+        async def read():
+            state["data"] = await device.read_all_data()
+        return read()
+
+    def upload():
+        if "data" in state:
+            system.data_uploader.upload_data(state["data"])
+
+    # On the board the lights run as a scheduler service, a cycle switches any transition that is due
+    async def check_lights():
+        device.check_lights()
+
+    return [
+        ("solenoids", "solenoids", device.open_close_solenoids),
+        ("read_all_data", "data_reader", read_all_data),
+        ("upload", "data_uploader", upload),
+        ("check_pump", "pump", device.check_pump),
+        ("check_lights", "lights", check_lights),
+        ("check_fans", "fans", device.check_fans),
+        ("fill_water", "water_level", system.fill_water),
+        ("nutrients", "nutrient_controller", system.control_nutrients),
+    ]
+
+
+def summarize(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return {
+        "mean_ms": round(sum(ordered) / len(ordered), 3),
+        "min_ms": round(ordered[0], 3),
+        "max_ms": round(ordered[-1], 3),
+        "p95_ms": round(p95, 3),
+    }
+
+
+def start_local_server():
+    import upload_server
+    server = upload_server.make_server("127.0.0.1", 0, None, os.path.join(ROOT, "config.json"))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Input: Scratch directory and optional local server
+# Output: Path to a config.json copy with the upload URLs pointed at the local server
+def write_config(workdir, server=None):
+    with open(os.path.join(ROOT, "config.json")) as f:
+        configs = json.load(f)
+    if server is not None:
+        base = "http://127.0.0.1:" + str(server.server_address[1]) + "/result"
+        for board in board_sections(configs).values():
+            upload = board.setdefault("upload", {})
+            upload["url"] = base
+            upload["batch_url"] = base + "/batch"
+            upload["binary_url"] = base + "/binary"
+            upload["stats_url"] = base + "/stats"
+    path = os.path.join(workdir, "config.json")
+    with open(path, "w") as f:
+        json.dump(configs, f)
+    return path
+
+
+def bench_cycles(profile, cycles, config_file, cpu_scale, seed):
+    sim = Simulation(board=profile, config_file=config_file, cpu_scale=cpu_scale, seed=seed,
+        workdir=tempfile.mkdtemp(prefix="esp-bench-"))
+    uasyncio = sim.modules["uasyncio"]
+    samples = {}
+    cycle_samples = []
+    real_start = time.perf_counter()
+    # The board code prints to the REPL, keep that out of the report
+    with sim, contextlib.redirect_stdout(io.StringIO()):
+        system = sim.make_system()
+        system.start()
+        esp_type = sim.board_configs["esp_type"]
+        table = phases(system)
+        for _ in range(cycles):
+            cycle_start = sim.clock.now_us()
+            for name, flag, fun in table:
+                if not esp_type.get(flag):
+                    continue
+                start = sim.clock.now_us()
+                result = fun()
+                if inspect.isawaitable(result):
+                    uasyncio.run(result)
+                samples.setdefault(name, []).append((sim.clock.now_us() - start) / 1000)
+            cycle_samples.append((sim.clock.now_us() - cycle_start) / 1000)
+        system.logger.flush()
+    loop_frequency = sim.board_configs["loop_frequency"]
+    cycle = summarize(cycle_samples)
+    return {
+        "loop_frequency_s": loop_frequency,
+        "phases": {name: summarize(samples[name]) for name in samples},
+        "cycle": cycle,
+        # Share of loop_frequency a sequential cycle takes, above 1 the loop cannot keep its cadence
+        "utilization": round(cycle["mean_ms"] / (loop_frequency * 1000), 4),
+        "real_s": round(time.perf_counter() - real_start, 3),
+    }
+
+
+def bench_scheduler(profile, duration, config_file, cpu_scale, seed):
+    sim = Simulation(board=profile, config_file=config_file, cpu_scale=cpu_scale, seed=seed,
+        workdir=tempfile.mkdtemp(prefix="esp-bench-"))
+    real_start = time.perf_counter()
+    with sim, contextlib.redirect_stdout(io.StringIO()):
+        system = sim.run_system(duration)
+        report = system.scheduler.report()
+        timings = sim.import_module("timing").Timings.report()
+    return {
+        "duration_s": duration,
+        "tasks": report,
+        # Per-call timings as recorded by the board itself
+        "timings": timings,
+        "real_s": round(time.perf_counter() - real_start, 3),
+    }
+
+
+# Input: Current and baseline results, allowed slowdown in percent
+# Output: List of regression descriptions
+def compare(results, baseline, threshold):
+    regressions = []
+    for profile, current in results["profiles"].items():
+        base = baseline.get("profiles", {}).get(profile)
+        if base is None:
+            continue
+        pairs = [("cycle", current["cycles"]["cycle"], base["cycles"]["cycle"])]
+        for name, stats in current["cycles"]["phases"].items():
+            pairs.append((name, stats, base["cycles"]["phases"].get(name)))
+        for name, stats, base_stats in pairs:
+            if not stats or not base_stats or base_stats["mean_ms"] <= 0:
+                continue
+            change = 100.0 * (stats["mean_ms"] - base_stats["mean_ms"]) / base_stats["mean_ms"]
+            if change > threshold:
+                regressions.append("%s %s: %.1f ms -> %.1f ms (+%.1f%%)" % (
+                    profile, name, base_stats["mean_ms"], stats["mean_ms"], change))
+    return regressions
+
+
+def print_table(results):
+    for profile, result in results["profiles"].items():
+        cycles = result["cycles"]
+        print("%s (loop_frequency %ss)" % (profile, cycles["loop_frequency_s"]))
+        for name, stats in cycles["phases"].items():
+            print("  %-14s mean %10.1f ms  p95 %10.1f ms  max %10.1f ms" % (
+                name, stats["mean_ms"], stats["p95_ms"], stats["max_ms"]))
+        print("  %-14s mean %10.1f ms  utilization %.1f%%" % (
+            "cycle", cycles["cycle"]["mean_ms"], 100 * cycles["utilization"]))
+        for name, stats in result.get("scheduler", {}).get("tasks", {}).items():
+            print("  task %-20s runs %4d  max lateness %8d ms  overruns %d" % (
+                name, stats["runs"], stats["max_lateness_ms"], stats["overruns"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the control loop on simulated hardware")
+    parser.add_argument("--board", action="append", help="irrigation or nutrient, may be repeated, defaults to both")
+    parser.add_argument("--cycles", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=3600, help="simulated seconds of the scheduler run")
+    parser.add_argument("--cpu-scale", type=float, default=1.0, help="how many times slower the chip is than this host")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--local-server", action="store_true", help="upload to a local stand-in server")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline results JSON to check for regressions")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed slowdown in percent")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="esp-bench-")
+    server = start_local_server() if args.local_server else None
+    config_file = write_config(workdir, server)
+    with open(config_file) as f:
+        configs = json.load(f)
+    profiles = args.board or [profile_name(board) for board in board_sections(configs).values()]
+
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_scale": args.cpu_scale,
+        "profiles": {},
+    }
+    for profile in profiles:
+        find_board(configs, profile)
+        results["profiles"][profile] = {
+            "cycles": bench_cycles(profile, args.cycles, config_file, args.cpu_scale, args.seed),
+            "scheduler": bench_scheduler(profile, args.duration, config_file, args.cpu_scale, args.seed),
+        }
+    if server is not None:
+        results["uploads_received"] = len(server.RequestHandlerClass.store.results)
+        server.shutdown()
+
+    print_table(results)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+# Builds the board code to .mpy bytecode so the board does not compile its sources at boot
+#
+# Usage: python3 tools/build.py [--board irrigation] [--out build] [--mpy-cross mpy-cross] [-O 1]
+#                               [--manifest] [--report]
+#
+# Writes <out>/<profile>/ with main.py, config.json, the board's compiled config and an mpy/
+# directory holding every other module as .mpy. Copy the directory to the board's filesystem root,
+# e.g. mpremote cp -r build/irrigation/. : ; main.py puts /mpy ahead of the sources on sys.path so
+# the bytecode is imported even when old .py copies are still on the board. Remove /mpy to go back
+# to running the sources.
+#
+# --manifest also writes <out>/manifest.py for freezing the modules into a custom firmware image.
+# --report boots each board in the simulator with its modules imported from source and from
+# precompiled bytecode, and reports the boot time and peak heap of both.
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+from compile_config import MODULE_NAME, compile_configs  # noqa: E402
+from configschema import board_sections, find_board, profile_name  # noqa: E402
+from sim import Simulation  # noqa: E402
+
+# Run as source by MicroPython, so never compiled
+SOURCE_FILES = ("main.py", "boot.py")
+MPY_DIR = "mpy"
+
+
+# Output: Paths of the board modules in the repository root
+def board_modules():
+    modules = []
+    for path in sorted(glob.glob(os.path.join(ROOT, "*.py"))):
+        name = os.path.basename(path)
+        if name in SOURCE_FILES or name.startswith("test_"):
+            continue
+        modules.append(path)
+    return modules
+
+
+# Input: Optional path of the mpy-cross binary
+# Output: Command list that runs mpy-cross
+def find_mpy_cross(path=None):
+    if path:
+        return [path]
+    if shutil.which("mpy-cross"):
+        return ["mpy-cross"]
+    try:
+        import mpy_cross  # noqa: F401
+    except ImportError:
+        raise SystemExit("mpy-cross not found, install it with pip install mpy-cross or pass --mpy-cross")
+    return [sys.executable, "-m", "mpy_cross"]
+
+
+def cross_compile(mpy_cross, source, target, opt):
+    # The source name embedded in tracebacks is the file name on the board
+    command = mpy_cross + ["-O" + str(opt), "-s", os.path.basename(source), "-o", target, source]
+    subprocess.run(command, check=True)
+
+
+# Input: Board profile or unique_id key, parsed config.json, output directory and mpy-cross options
+# Output: Dictionary of module name to (source bytes, mpy bytes)
+def build_board(board, configs, out_dir, mpy_cross, opt):
+    key, section = find_board(configs, board)
+    board_dir = os.path.join(out_dir, profile_name(section))
+    mpy_dir = os.path.join(board_dir, MPY_DIR)
+    shutil.rmtree(board_dir, ignore_errors=True)
+    os.makedirs(mpy_dir)
+    config_path = compile_configs(configs, out_dir, key)[0]
+    sizes = {}
+    for source in board_modules() + [config_path]:
+        name = os.path.splitext(os.path.basename(source))[0]
+        target = os.path.join(mpy_dir, name + ".mpy")
+        cross_compile(mpy_cross, source, target, opt)
+        sizes[name] = (os.path.getsize(source), os.path.getsize(target))
+    os.remove(config_path)
+    for name in SOURCE_FILES + ("config.json",):
+        if os.path.exists(os.path.join(ROOT, name)):
+            shutil.copy(os.path.join(ROOT, name), board_dir)
+    return sizes
+
+
+def write_manifest(out_dir):
+    lines = ["# Generated by tools/build.py, freezes the board modules into the firmware",
+        'include("$(PORT_DIR)/boards/manifest.py")']
+    for path in board_modules():
+        lines.append("module(%r, base_path=%r)" % (os.path.basename(path), ROOT))
+    path = os.path.join(out_dir, "manifest.py")
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+
+# Input: Board profile, config file and whether the modules are imported from precompiled bytecode
+# Output: Dictionary with the simulated boot time and the peak heap while booting
+# CPython's cached bytecode stands in for .mpy: both skip the compile step the board pays at boot
+def measure_boot(board, config_file, compiled, cpu_scale):
+    cache = tempfile.mkdtemp(prefix="esp-pycache-")
+    saved = sys.pycache_prefix, sys.dont_write_bytecode
+    sys.pycache_prefix = cache
+    try:
+        if compiled:
+            sys.dont_write_bytecode = False
+            for path in board_modules():
+                subprocess.run([sys.executable, "-c", "import py_compile, sys; sys.pycache_prefix = %r; "
+                    "py_compile.compile(%r)" % (cache, path)], check=True)
+        else:
+            sys.dont_write_bytecode = True
+        sim = Simulation(board=board, config_file=config_file, cpu_scale=cpu_scale,
+            workdir=tempfile.mkdtemp(prefix="esp-build-"))
+        with sim, contextlib.redirect_stdout(io.StringIO()):
+            tracemalloc.start()
+            start = sim.clock.now_us()
+            sim.import_module("system")
+            imported = sim.clock.now_us()
+            sim.make_system()
+            booted = sim.clock.now_us()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    finally:
+        sys.pycache_prefix, sys.dont_write_bytecode = saved
+        shutil.rmtree(cache, ignore_errors=True)
+    return {
+        "import_ms": round((imported - start) / 1000, 1),
+        "boot_ms": round((booted - start) / 1000, 1),
+        "peak_heap_kb": round(peak / 1024, 1),
+    }
+
+
+# Input: Board profile, config file, number of boots per mode and the chip's slowdown
+# Output: Dictionary with the median of each measurement from source and from bytecode
+def boot_report(board, config_file, repeat, cpu_scale):
+    report = {}
+    for mode, compiled in (("source", False), ("compiled", True)):
+        runs = [measure_boot(board, config_file, compiled, cpu_scale) for _ in range(repeat)]
+        report[mode] = {key: sorted(run[key] for run in runs)[len(runs) // 2] for key in runs[0]}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the board code to .mpy bytecode")
+    parser.add_argument("--config", default=os.path.join(ROOT, "config.json"))
+    parser.add_argument("--board", action="append", help="irrigation, nutrient or a unique_id key, defaults to every board")
+    parser.add_argument("--out", default=os.path.join(ROOT, "build"))
+    parser.add_argument("--mpy-cross", help="path of the mpy-cross binary matching the board's firmware")
+    parser.add_argument("-O", dest="opt", type=int, default=1, help="mpy-cross optimization level")
+    parser.add_argument("--manifest", action="store_true", help="also write a manifest.py for frozen firmware")
+    parser.add_argument("--report", action="store_true", help="measure boot time and peak heap in the simulator")
+    parser.add_argument("--repeat", type=int, default=3, help="boots per mode for --report")
+    parser.add_argument("--cpu-scale", type=float, default=20.0, help="how many times slower the chip is than this host")
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        configs = json.load(f)
+    boards = args.board or [profile_name(section) for section in board_sections(configs).values()]
+    mpy_cross = find_mpy_cross(args.mpy_cross)
+    version = subprocess.run(mpy_cross + ["--version"], capture_output=True, text=True).stdout.strip()
+    print(version)
+    results = {}
+    for board in boards:
+        sizes = build_board(board, configs, args.out, mpy_cross, args.opt)
+        source = sum(size[0] for size in sizes.values())
+        compiled = sum(size[1] for size in sizes.values())
+        print("%s: %d modules, %d bytes of source, %d bytes of bytecode" % (board, len(sizes), source, compiled))
+        results[board] = {"modules": sizes}
+        if args.report:
+            report = boot_report(board, args.config, args.repeat, args.cpu_scale)
+            for mode in ("source", "compiled"):
+                print("  %-8s import %8.1f ms  boot %8.1f ms  peak heap %8.1f kB" % (mode,
+                    report[mode]["import_ms"], report[mode]["boot_ms"], report[mode]["peak_heap_kb"]))
+            results[board]["boot"] = report
+    if args.manifest:
+        print(write_manifest(args.out))
+    with open(os.path.join(args.out, "build.json"), "w") as f:
+        json.dump({"mpy_cross": version, "boards": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Compiles config.json into one small module per board
+#
+# Usage: python3 tools/compile_config.py [--config config.json] [--out build] [--board irrigation]
+#
+# Writes <out>/<profile>/compiled_config.py holding only the board's own section. Copy it next to
+# the board code (or build it to .mpy) and configloader.load_configs imports it at boot instead of
+# parsing every board's section with ujson. The module holds only UNIQUE_ID and the CONFIG dictionary,
+# so the board keeps one copy of its config on the heap.
+import argparse
+import copy
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import configschema  # noqa: E402
+from configschema import board_sections, find_board, profile_name  # noqa: E402
+
+MODULE_NAME = "compiled_config"
+
+
+# Input: unique_id key of the board and its config section
+# Output: Source of the board's compiled config module
+# The section is validated and its dates converted to tuples, the board does not check it again
+def compile_board(board_id, configs):
+    configs = configschema.check(copy.deepcopy(configs))
+    lines = [
+        "# Generated by tools/compile_config.py, do not edit",
+        "UNIQUE_ID = " + repr(board_id),
+        "CONFIG = " + repr(configs),
+    ]
+    return "\n".join(lines) + "\n"
+
+
+# Input: Parsed config.json, output directory and optional board profile or unique_id
+# Output: List of the written module paths
+def compile_configs(configs, out_dir, board=None):
+    if board is None:
+        boards = board_sections(configs)
+    else:
+        key, section = find_board(configs, board)
+        boards = {key: section}
+    paths = []
+    for key, section in boards.items():
+        board_dir = os.path.join(out_dir, profile_name(section))
+        os.makedirs(board_dir, exist_ok=True)
+        path = os.path.join(board_dir, MODULE_NAME + ".py")
+        with open(path, "w") as f:
+            f.write(compile_board(key, section))
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile config.json into one config module per board")
+    parser.add_argument("--config", default=os.path.join(ROOT, "config.json"))
+    parser.add_argument("--out", default=os.path.join(ROOT, "build"))
+    parser.add_argument("--board", help="irrigation, nutrient or a unique_id key, defaults to every board")
+    args = parser.parse_args()
+    with open(args.config) as f:
+        configs = json.load(f)
+    for path in compile_configs(configs, args.out, args.board):
+        print("%s (%d bytes)" % (path, os.path.getsize(path)))
+
+
+if __name__ == "__main__":
+    main()
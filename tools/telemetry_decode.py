@@ -0,0 +1,36 @@
+# Decodes binary telemetry records sent by boards using the "binary" upload format
+#
+# Usage: python3 tools/telemetry_decode.py [--config config.json] payload.bin
+# The schemas of every board in config.json are rebuilt the same way the device builds its own.
+import argparse
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from configschema import board_sections  # noqa: E402
+from telemetry import TelemetryDecoder, build_schema  # noqa: E402
+
+
+def load_decoder(config_file=os.path.join(ROOT, "config.json")):
+    with open(config_file) as f:
+        configs = json.load(f)
+    return TelemetryDecoder([build_schema(board) for board in board_sections(configs).values()])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode binary telemetry records to JSON lines")
+    parser.add_argument("payload", help="file holding one or more concatenated records")
+    parser.add_argument("--config", default=os.path.join(ROOT, "config.json"))
+    args = parser.parse_args()
+    decoder = load_decoder(args.config)
+    with open(args.payload, "rb") as f:
+        payload = f.read()
+    for record in decoder.decode(payload):
+        print(json.dumps(record))
+
+
+if __name__ == "__main__":
+    main()
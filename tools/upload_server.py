@@ -0,0 +1,157 @@
+# Local stand-in for the Azure result server, used to test uploads from a Linux machine
+#
+# Usage: python3 tools/upload_server.py [--port 8000] [--out results.jsonl] [--config config.json]
+# Point a board (or the simulator) at it with "url": "http://<host>:8000/result",
+# "batch_url": "http://<host>:8000/result/batch", "binary_url": "http://<host>:8000/result/binary"
+# and "stats_url": "http://<host>:8000/result/stats" in the board's "upload" config section. Binary records are decoded with the schemas of --config.
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telemetry_decode import load_decoder
+
+
+class ResultStore:
+
+    def __init__(self, out_file=None):
+        self.results = []
+        self.stats = []
+        self.requests = 0
+        self.out_file = out_file
+        self.lock = threading.Lock()
+
+    def add(self, readings):
+        with self.lock:
+            self.requests += 1
+            ids = []
+            for reading in readings:
+                self.results.append(reading)
+                ids.append(len(self.results))
+                if self.out_file:
+                    with open(self.out_file, "a") as f:
+                        f.write(json.dumps(reading) + "\n")
+            return ids
+
+    def add_stats(self, stats):
+        with self.lock:
+            self.requests += 1
+            self.stats.append(stats)
+            return len(self.stats)
+
+    def get(self, result_id):
+        with self.lock:
+            if 1 <= result_id <= len(self.results):
+                return self.results[result_id - 1]
+            return None
+
+    def latest(self):
+        with self.lock:
+            return self.results[-1] if self.results else None
+
+
+class ResultHandler(BaseHTTPRequestHandler):
+
+    # HTTP/1.1 keeps the connection open between requests, like the device's HTTPSession expects
+    protocol_version = "HTTP/1.1"
+    store = None
+    decoder = None
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def _put_binary(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = self.rfile.read(length)
+        if self.decoder is None:
+            self._reply(501, {"error": "start the server with --config to accept binary records"})
+            return
+        try:
+            records = self.decoder.decode(payload)
+        except (ValueError, IndexError) as e:
+            self._reply(400, {"error": "invalid telemetry: " + str(e)})
+            return
+        ids = self.store.add(records)
+        self._reply(201, {"count": len(ids), "ids": ids, "bytes": length})
+
+    def do_PUT(self):
+        if self.path == "/result/binary":
+            self._put_binary()
+            return
+        try:
+            body = self._read_json()
+        except ValueError as e:
+            self._reply(400, {"error": "invalid JSON: " + str(e)})
+            return
+        if self.path == "/result":
+            if not isinstance(body, dict):
+                self._reply(400, {"error": "expected a JSON object"})
+                return
+            ids = self.store.add([body])
+            self._reply(201, {"id": ids[0]})
+        elif self.path == "/result/batch":
+            if not isinstance(body, list):
+                self._reply(400, {"error": "expected a JSON array"})
+                return
+            ids = self.store.add(body)
+            self._reply(201, {"count": len(ids), "ids": ids})
+        elif self.path == "/result/stats":
+            if not isinstance(body, dict):
+                self._reply(400, {"error": "expected a JSON object"})
+                return
+            self._reply(201, {"id": self.store.add_stats(body)})
+        else:
+            self._reply(404, {"error": "unknown endpoint"})
+
+    do_POST = do_PUT
+
+    def do_GET(self):
+        if self.path == "/latest":
+            self._reply(200, self.store.latest())
+            return
+        if self.path == "/stats":
+            self._reply(200, self.store.stats)
+            return
+        if self.path.startswith("/result/"):
+            try:
+                result = self.store.get(int(self.path[len("/result/"):]))
+            except ValueError:
+                result = None
+            if result is not None:
+                self._reply(200, result)
+                return
+        self._reply(404, {"error": "not found"})
+
+
+def make_server(host="0.0.0.0", port=8000, out_file=None, config_file=None):
+    decoder = load_decoder(config_file) if config_file else None
+    handler = type("Handler", (ResultHandler,), {"store": ResultStore(out_file), "decoder": decoder})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the result server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--out", help="append every received reading to this JSON lines file")
+    parser.add_argument("--config", help="config.json used to decode binary telemetry")
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, args.out, args.config)
+    print("Listening on http://%s:%d" % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
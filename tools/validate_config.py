@@ -0,0 +1,63 @@
+# Checks config.json against the board config schema before it is deployed
+#
+# Usage: python3 tools/validate_config.py [config.json ...]
+#
+# Reports JSON syntax errors with their line, duplicate keys and every schema error of every board
+# section, and exits with status 1 when anything is wrong. The board runs the same schema at boot.
+import argparse
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import configschema  # noqa: E402
+from configschema import board_sections  # noqa: E402
+
+
+# Input: Path of a config file
+# Output: List of error messages
+def validate_file(path):
+    errors = []
+
+    def no_duplicates(pairs):
+        seen = {}
+        for key, value in pairs:
+            if key in seen:
+                errors.append("duplicate key " + repr(key))
+            seen[key] = value
+        return seen
+
+    try:
+        with open(path) as f:
+            configs = json.load(f, object_pairs_hook=no_duplicates)
+    except ValueError as e:
+        return ["invalid JSON: " + str(e)]
+    boards = board_sections(configs)
+    if not boards:
+        errors.append("no board sections")
+    for board_id, section in boards.items():
+        for error in configschema.validate(section):
+            errors.append(board_id + ": " + error)
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate board config files")
+    parser.add_argument("configs", nargs="*", default=[os.path.join(ROOT, "config.json")])
+    args = parser.parse_args()
+    failed = False
+    for path in args.configs:
+        errors = validate_file(path)
+        for error in errors:
+            print(path + ": " + error)
+        if errors:
+            failed = True
+        else:
+            print(path + ": ok")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# This class handles the on-flash queue of readings that have not been uploaded yet
+import os
+import ujson
+
+class UploadQueue:
+
+    # Input: Queue file name, maximum number of queued readings, number of oldest readings dropped when full
+    def __init__(self, file_name, max_entries=200, evict_count=10):
+        self.file_name = file_name
+        self.max_entries = max_entries
+        self.evict_count = max(1, min(evict_count, max_entries))
+        self.evicted = 0
+        # Readings dropped because their line did not parse, e.g. after power loss during an append
+        self.corrupted = 0
+        self._recover()
+        # The queue lives on flash, only its length is kept in RAM
+        self.count = self._count_entries()
+
+    # A leftover temp file is the rewritten queue when power failed before it replaced the queue file,
+    # otherwise the queue file is intact and the temp file may be partly written
+    def _recover(self):
+        tmp_name = self.file_name + ".tmp"
+        try:
+            os.stat(tmp_name)
+        except OSError:
+            return
+        try:
+            os.stat(self.file_name)
+            os.remove(tmp_name)
+        except OSError:
+            os.rename(tmp_name, self.file_name)
+
+    def _count_entries(self):
+        count = 0
+        try:
+            with open(self.file_name) as f:
+                for line in f:
+                    if line.strip():
+                        count += 1
+        except OSError:
+            pass
+        return count
+
+    # Input: Dictionary of readings
+    # Output: None
+    # Appends a reading to the queue, dropping the oldest readings when the queue is full
+    def push(self, data):
+        if self.count >= self.max_entries:
+            self.pop(self.evict_count)
+            self.evicted += self.evict_count
+        with open(self.file_name, "a") as f:
+            f.write(ujson.dumps(data) + "\n")
+        self.count += 1
+
+    # Input: Maximum number of readings
+    # Output: List of the oldest readings, left in the queue
+    # Lines that do not parse are dropped from the queue, so they cannot hold up the readings behind them
+    def peek(self, n):
+        items = []
+        if self.count == 0:
+            return items
+        corrupted = False
+        with open(self.file_name) as f:
+            for line in f:
+                if len(items) >= n:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    items.append(ujson.loads(line))
+                except ValueError:
+                    corrupted = True
+        if corrupted:
+            self._rewrite(0)
+            return self.peek(n)
+        return items
+
+    # Input: Number of readings
+    # Output: None
+    # Removes the n oldest readings by streaming the rest into a new file
+    def pop(self, n):
+        if n <= 0:
+            return
+        if n >= self.count:
+            self.clear()
+            return
+        self._rewrite(n)
+
+    # Streams the queue into a temp file without its n oldest readings, or without the lines that do not
+    # parse when n is 0, and renames it over the queue file so power loss leaves one of the two intact
+    def _rewrite(self, n):
+        tmp_name = self.file_name + ".tmp"
+        skipped = 0
+        kept = 0
+        with open(self.file_name) as src:
+            with open(tmp_name, "w") as dst:
+                for line in src:
+                    if not line.strip():
+                        continue
+                    if skipped < n:
+                        skipped += 1
+                        continue
+                    if n == 0:
+                        try:
+                            ujson.loads(line)
+                        except ValueError:
+                            self.corrupted += 1
+                            continue
+                    dst.write(line)
+                    kept += 1
+        try:
+            os.rename(tmp_name, self.file_name)
+        except OSError:
+            # FAT cannot rename over an existing file, _recover() picks up the temp file if power fails here
+            os.remove(self.file_name)
+            os.rename(tmp_name, self.file_name)
+        self.count = kept
+
+    def clear(self):
+        try:
+            os.remove(self.file_name)
+        except OSError:
+            pass
+        self.count = 0
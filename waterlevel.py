@@ -0,0 +1,95 @@
+# This class handles the reservoir level, filtering a burst of HC-SR04 pings into one reading
+import uasyncio
+from time import time
+from logger import Logger
+
+class WaterLevel:
+
+    ESP_LOG_FILE = "esp_log.txt"
+    # Pings per reading, odd so the median is a single ping
+    PINGS = 7
+    # Milliseconds between pings, enough for the echo of the previous ping to die out in the reservoir
+    PING_INTERVAL = 30
+    # Pings further than this many cm from the median are rejected as reflections
+    MAX_DEVIATION = 1.0
+    # Share of pings that have to agree for a reading to be trusted
+    MIN_CONFIDENCE = 0.5
+    # Seconds the last good reading stands in for failed ones
+    MAX_AGE = 600
+    # Closest distance the HC-SR04 measures
+    MIN_CM = 2
+    # Air temperature used when no reservoir temperature is available
+    DEFAULT_TEMPERATURE = 20
+
+    # Input: HCSR04 driver, height of the reservoir in cm, the optional "water_level" section of the board
+    #        config and a function returning the reservoir temperature in C or None
+    def __init__(self, sensor, reservoir_height, configs=None, temperature=None):
+        if configs is None:
+            configs = {}
+        self.logger = Logger(self.ESP_LOG_FILE)
+        self.sensor = sensor
+        self.reservoir_height = reservoir_height
+        self.pings = configs.get("pings", self.PINGS)
+        self.ping_interval = configs.get("ping_interval", self.PING_INTERVAL)
+        self.max_deviation = configs.get("max_deviation", self.MAX_DEVIATION)
+        self.min_confidence = configs.get("min_confidence", self.MIN_CONFIDENCE)
+        self.max_age = configs.get("max_age", self.MAX_AGE)
+        self.temperature = temperature if configs.get("temperature_compensation", 1) else None
+        # Pulses longer than a round trip past the bottom of the reservoir are reflections or timeouts
+        self.max_cm = reservoir_height + 10
+        self.distances = [0.0] * self.pings
+        # Level in cm, share of agreeing pings and time of the last trusted reading
+        self.level = None
+        self.confidence = 0
+        self.timestamp = None
+        self.timeouts = 0
+
+    # Input: None
+    # Output: Speed of sound in cm/us for the current temperature
+    def speed_of_sound(self):
+        temperature = None
+        if self.temperature is not None:
+            temperature = self.temperature()
+        if temperature is None:
+            temperature = self.DEFAULT_TEMPERATURE
+        return (331.3 + 0.606 * temperature) / 10000
+
+    # Input: None
+    # Output: Tuple of (median distance in cm or None, share of pings within max_deviation of it)
+    async def measure(self):
+        speed = self.speed_of_sound()
+        count = 0
+        for i in range(self.pings):
+            if i:
+                await uasyncio.sleep_ms(self.ping_interval)
+            pulse = self.sensor.pulse_us()
+            if pulse is None:
+                self.timeouts += 1
+                continue
+            distance = pulse / 2 * speed
+            if self.MIN_CM <= distance <= self.max_cm:
+                self.distances[count] = distance
+                count += 1
+        if not count:
+            return None, 0
+        valid = sorted(self.distances[:count])
+        median = valid[count // 2]
+        inliers = [d for d in valid if abs(d - median) <= self.max_deviation]
+        return inliers[len(inliers) // 2], len(inliers) / self.pings
+
+    # Input: Seconds an older trusted reading may stand in for a rejected one, defaults to max_age
+    # Output: Water level in cm, the last trusted one when the pings disagree and it is recent, otherwise None
+    async def read(self, max_age=None):
+        if max_age is None:
+            max_age = self.max_age
+        distance, confidence = await self.measure()
+        now = time()
+        self.confidence = confidence
+        if distance is not None and confidence >= self.min_confidence:
+            self.level = self.reservoir_height - distance
+            self.timestamp = now
+            return self.level
+        self.logger.log("Water level rejected, confidence " + str(confidence))
+        if self.timestamp is not None and now - self.timestamp <= max_age:
+            return self.level
+        return None